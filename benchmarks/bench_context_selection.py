@@ -0,0 +1,103 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from consts import *
+from synthetic_data import make_synthetic_posts_df
+from tiny_mt5 import make_tiny_mt5
+from evaluation import load_test_df, generate_in_length_sorted_batches
+from metric_engine import calc_bleu_scores, calc_rouge_scores, calc_bertscores, average_bleu_scores, \
+    average_rouge_scores, average_bertscores
+
+
+def make_synthetic_test_df(num_rows, sentence_length=12):
+    """
+    creates a synthetic test dataframe whose article bodies are made of sentences
+    :param num_rows: number of rows
+    :param sentence_length: number of words per sentence
+    :return: test dataframe
+    """
+    test_df = make_synthetic_posts_df(num_rows, body_length=(100, 800))
+    test_df[BODY_COLUMN_NAME] = ['. '.join(' '.join(words[i:i + sentence_length])
+                                           for i in range(0, len(words), sentence_length)) + '.'
+                                 for words in test_df[BODY_COLUMN_NAME].str.split(' ')]
+    return test_df
+
+
+def evaluate_context(model, tokenizer, test_data_path, batch_size, context_size=None, select_context=False,
+                     use_bertscore=True):
+    """
+    generates and scores predictions with full or reduced context
+    :return: dictionary of input length, timings and average scores
+    """
+    start_time = time.perf_counter()
+    test_df = load_test_df(test_data_path, tokenizer, context_size, select_context)
+    all_input_ids = tokenizer(test_df[MODEL_INPUT_COLUMN_NAME].tolist())[MODEL_INPUT_IDS]
+    preparation_time = time.perf_counter() - start_time
+    start_time = time.perf_counter()
+    predictions, _ = generate_in_length_sorted_batches(model, tokenizer, all_input_ids, batch_size)
+    generation_time = time.perf_counter() - start_time
+    # empty predictions can not be scored by ROUGE
+    pairs = [(prediction or '-', reference) for prediction, reference in zip(predictions,
+                                                                              test_df[LABEL_COLUMN_NAME])]
+    results = {'avg_input_tokens': np.mean([len(input_ids) for input_ids in all_input_ids]),
+               'preparation_sec': preparation_time, 'generation_sec': generation_time,
+               'bleu': average_bleu_scores(calc_bleu_scores(pairs)),
+               'rouge-l_f': average_rouge_scores(calc_rouge_scores(pairs))['rouge-l']['f']}
+    if use_bertscore:
+        results['BERTscore_f1'] = average_bertscores(calc_bertscores(pairs))['f1']
+    return results
+
+
+def run_benchmark(test_data_path, model_name, context_size, batch_size, use_bertscore):
+    """
+    compares generation with the full article bodies to generation with the sentences selected by BM25
+    :return: dictionary of the results of both, the speedup and the change of every score
+    """
+    import transformers
+    with tempfile.TemporaryDirectory() as work_dir:
+        if model_name is None:
+            model, tokenizer = make_tiny_mt5(os.path.join(work_dir, 'tiny_mt5'))
+        else:
+            model = transformers.MT5ForConditionalGeneration.from_pretrained(model_name).eval()
+            tokenizer = transformers.MT5Tokenizer.from_pretrained(model_name)
+        full_results = evaluate_context(model, tokenizer, test_data_path, batch_size, use_bertscore=use_bertscore)
+        selected_results = evaluate_context(model, tokenizer, test_data_path, batch_size, context_size, True,
+                                            use_bertscore)
+    full_time = full_results['preparation_sec'] + full_results['generation_sec']
+    selected_time = selected_results['preparation_sec'] + selected_results['generation_sec']
+    return {'full': full_results, 'selected': selected_results, 'speedup': full_time / selected_time,
+            'score_change': {name: selected_results[name] - full_results[name]
+                             for name in ['bleu', 'rouge-l_f', 'BERTscore_f1'] if name in full_results}}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--test_data_path', '-t', type=str, help='path to test csv (default: synthetic articles)')
+    parser.add_argument('--num_examples', type=int, help='number of synthetic examples', default=64)
+    parser.add_argument('--model_name', '-n', type=str, help='model to generate with (default: tiny mT5)')
+    parser.add_argument('--context_size', '-c', type=int, help='token budget of the selected context', default=128)
+    parser.add_argument('--batch_size', '-b', type=int, help='generation batch size', default=GENERATION_BATCH_SIZE)
+    parser.add_argument('--no_bertscore', action='store_true', help='skip BERTscore (needs to download its model)')
+    parser.add_argument('--output', '-o', type=str, help='path to write the results json to')
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    test_data_path = args.test_data_path
+    if test_data_path is None:
+        test_data_path = os.path.join(tempfile.mkdtemp(), 'test.csv')
+        make_synthetic_test_df(args.num_examples).to_csv(test_data_path, index=False)
+    results = run_benchmark(test_data_path, args.model_name, args.context_size, args.batch_size,
+                            not args.no_bertscore)
+    print(json.dumps(results, indent=2))
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
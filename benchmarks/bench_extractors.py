@@ -0,0 +1,66 @@
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from html_parsing import parse_html, PARSER_BACKENDS
+from scraper import extract_from_tmi, extract_from_mako, extract_from_walla
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+FIXTURE_EXTRACTORS = {'tmi.html': extract_from_tmi,
+                      'mako.html': extract_from_mako,
+                      'walla.html': extract_from_walla}
+
+
+def time_extractor(content, extractor, backend, num_repeats):
+    """
+    times parsing and extracting a single article page
+    :param content: raw HTML of the page
+    :param extractor: extractor function of the site
+    :param backend: name of the parsing backend
+    :param num_repeats: number of times to repeat the measurement
+    :return: extracted article, and median time per article (in ms)
+    """
+    times = []
+    for _ in range(num_repeats):
+        start = time.perf_counter()
+        article = extractor(parse_html(content, backend))
+        times.append(time.perf_counter() - start)
+    return article, np.median(times) * 1000
+
+
+def run_benchmark(num_repeats):
+    """
+    compares parse time per article between the parsing backends on the saved HTML fixtures
+    :param num_repeats: number of times to repeat each measurement
+    :return: dictionary of fixture name to dictionary of backend name to median time per article (in ms)
+    """
+    results = {}
+    for fixture_name, extractor in FIXTURE_EXTRACTORS.items():
+        with open(os.path.join(FIXTURES_DIR, fixture_name), 'rb') as f:
+            content = f.read()
+        bs4_article, _ = time_extractor(content, extractor, 'bs4', 1)
+        results[fixture_name] = {}
+        for backend in PARSER_BACKENDS:
+            article, ms_per_article = time_extractor(content, extractor, backend, num_repeats)
+            assert article == bs4_article, f"{backend} extracted a different article from {fixture_name}"
+            results[fixture_name][backend] = ms_per_article
+    return results
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num_repeats', '-r', type=int, help='number of repeats per measurement', default=50)
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    results = run_benchmark(args.num_repeats)
+    for fixture_name, backend_times in results.items():
+        bs4_time = backend_times['bs4']
+        for backend, ms_per_article in backend_times.items():
+            print(f'{fixture_name:12} {backend:12} {ms_per_article:8.2f} ms/article  x{bs4_time / ms_per_article:.1f}')
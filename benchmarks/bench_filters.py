@@ -0,0 +1,72 @@
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from consts import *
+from data_preprocessing import filter_posts_contained_in_art_title
+from synthetic_data import make_synthetic_posts_df
+
+
+def filter_posts_contained_in_art_title_loop(posts_df):
+    """
+    the original row by row implementation of filter_posts_contained_in_art_title, kept as the reference
+    :param posts_df: posts dataframe
+    :return: filtered dataframe
+    """
+    good_idxs_mask = np.full(len(posts_df), False)
+    for i in range(len(posts_df)):
+        art_title = posts_df[ARTICLE_TITLE_COLUMN_NAME][i]
+        post_text = posts_df[POST_TEST_COLUMN_NAME][i]
+        if post_text in art_title:
+            continue
+        if " " in post_text:
+            post_text_list = post_text.split(" ")
+        else:
+            post_text_list = [post_text]
+        if " " in art_title:
+            art_title_list = art_title.split(" ")
+        else:
+            art_title_list = [art_title]
+        post_art_title_overlap = list(set(art_title_list) & set(post_text_list))
+        if len(post_art_title_overlap) > MAX_TITLE_POST_TEXT_SIMILAR_FACTOR * len(post_text_list):
+            continue
+        good_idxs_mask[i] = True
+    return posts_df[good_idxs_mask].reset_index(drop=True)
+
+
+def time_call(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def run_benchmark(sizes):
+    """
+    times the original and the batched filter_posts_contained_in_art_title, checking their results are identical
+    :param sizes: list of numbers of rows
+    :return: list of (num rows, loop time, batched time) in seconds
+    """
+    results = []
+    for num_rows in sizes:
+        posts_df = make_synthetic_posts_df(num_rows, body_length=(10, 30))
+        loop_df, loop_time = time_call(filter_posts_contained_in_art_title_loop, posts_df)
+        batched_df, batched_time = time_call(filter_posts_contained_in_art_title, posts_df)
+        assert loop_df.equals(batched_df), f"Different results for {num_rows} rows"
+        results.append((num_rows, loop_time, batched_time))
+    return results
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', '-s', type=int, nargs='+', help='numbers of rows', default=[10000, 100000, 1000000])
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    for num_rows, loop_time, batched_time in run_benchmark(args.sizes):
+        print(f'{num_rows:>9} rows  loop {loop_time:8.2f}s  batched {batched_time:6.2f}s (x{loop_time / batched_time:.0f})')
@@ -0,0 +1,249 @@
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import tracemalloc
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from consts import *
+from synthetic_data import make_synthetic_posts_df
+from tiny_mt5 import make_tiny_mt5
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+STAGES = ['extract', 'preprocess', 'near_duplicates', 'model_inputs', 'tokenize', 'generate', 'metrics']
+
+
+def measure(run_unit, units, num_items):
+    """
+    measures a pipeline stage: times every unit of work, then runs the first unit again under tracemalloc for the peak
+    memory (in a separate run, since tracing slows the code down)
+    :param run_unit: function called with each unit of work
+    :param units: list of the units of work (e.g. pages, batches or repeats of the whole stage)
+    :param num_items: number of items (pages, rows, examples) processed by each unit
+    :return: dictionary of throughput (items per second, by the median unit latency), unit latency percentiles (in ms)
+    and peak python memory allocated by a unit (in MB, tensors allocated by torch are not traced)
+    """
+    latencies = []
+    for unit in units:
+        start = time.perf_counter()
+        run_unit(unit)
+        latencies.append(time.perf_counter() - start)
+    tracemalloc.start()
+    run_unit(units[0])
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    p50, p95 = np.percentile(latencies, [50, 95]) * 1000
+    return {'num_items': num_items, 'num_units': len(units), 'items_per_sec': num_items * 1000 / p50,
+            'p50_ms': p50, 'p95_ms': p95, 'peak_memory_mb': peak_memory / 2 ** 20}
+
+
+def bench_extract(num_repeats):
+    """
+    parsing and extraction of the recorded article pages, with every parsing backend
+    """
+    from html_parsing import parse_html, PARSER_BACKENDS
+    from scraper import extract_from_tmi, extract_from_mako, extract_from_walla
+    results = {}
+    for fixture_name, extractor in [('tmi', extract_from_tmi), ('mako', extract_from_mako),
+                                    ('walla', extract_from_walla)]:
+        with open(os.path.join(FIXTURES_DIR, f'{fixture_name}.html'), 'rb') as f:
+            content = f.read()
+        for backend in PARSER_BACKENDS:
+            results[f'extract/{fixture_name}/{backend}'] = measure(lambda page: extractor(parse_html(page, backend)),
+                                                                   [content] * num_repeats, 1)
+    return results
+
+
+def bench_preprocess(sizes, num_repeats, work_dir):
+    """
+    filters and cleaners, separately and end to end from a posts csv to a clean csv
+    """
+    from data_preprocessing import apply_filters, apply_cleaning_funcs, preprocess_posts
+    results = {}
+    for num_rows in sizes:
+        posts_df = make_synthetic_posts_df(num_rows, body_length=(10, 60))
+        posts_path = os.path.join(work_dir, f'posts_{num_rows}.csv')
+        posts_df.to_csv(posts_path, index=False)
+        results[f'filters/{num_rows}'] = measure(apply_filters, [posts_df] * num_repeats, num_rows)
+        filtered_posts_df = apply_filters(posts_df)
+        results[f'cleaners/{num_rows}'] = measure(apply_cleaning_funcs,
+                                                  [filtered_posts_df.copy() for _ in range(num_repeats)],
+                                                  len(filtered_posts_df))
+        results[f'preprocess_csv/{num_rows}'] = measure(
+            lambda path: preprocess_posts(path, os.path.join(work_dir, 'clean_posts.csv')),
+            [posts_path] * num_repeats, num_rows)
+    return results
+
+
+def bench_near_duplicates(sizes, num_repeats):
+    """
+    MinHash/LSH near duplicate clustering of the posts
+    """
+    from data_preprocessing import find_near_duplicate_posts
+    return {f'near_duplicates/{num_rows}': measure(find_near_duplicate_posts,
+                                                   [make_synthetic_posts_df(num_rows, body_length=(10, 60))] *
+                                                   num_repeats, num_rows)
+            for num_rows in sizes}
+
+
+def bench_model_inputs(sizes, num_repeats):
+    """
+    building the model input text of every example
+    """
+    from utils import merge_article_title_and_body_into_one_for_model_input
+    results = {}
+    for num_rows in sizes:
+        posts_df = make_synthetic_posts_df(num_rows)
+        results[f'model_inputs/{num_rows}'] = measure(merge_article_title_and_body_into_one_for_model_input,
+                                                      [posts_df.copy() for _ in range(num_repeats)], num_rows)
+    return results
+
+
+def bench_tokenize(tokenizer, num_examples, num_repeats, context_size):
+    """
+    tokenization of the training examples (finetune_pipeline.preprocess_function), with padding to the context size
+    and with dynamic padding
+    """
+    import finetune_pipeline
+    from utils import merge_article_title_and_body_into_one_for_model_input
+    finetune_pipeline.tokenizer = tokenizer
+    examples = merge_article_title_and_body_into_one_for_model_input(make_synthetic_posts_df(num_examples))
+    examples = {MODEL_INPUT_COLUMN_NAME: examples[MODEL_INPUT_COLUMN_NAME].tolist(),
+                LABEL_COLUMN_NAME: examples[LABEL_COLUMN_NAME].tolist()}
+    return {f'tokenize/{padding}/{num_examples}': measure(
+        lambda batch: finetune_pipeline.preprocess_function(batch, context_size, padding == 'dynamic'),
+        [examples] * num_repeats, num_examples) for padding in ['max_length', 'dynamic']}
+
+
+def bench_generate(model, tokenizer, num_examples, batch_size, context_size):
+    """
+    batched generation of predictions, latency per batch (the batch size is at most the number of examples)
+    """
+    from utils import merge_article_title_and_body_into_one_for_model_input, generate_batch
+    batch_size = min(batch_size, num_examples)
+    examples = merge_article_title_and_body_into_one_for_model_input(make_synthetic_posts_df(num_examples))
+    all_input_ids = tokenizer(examples[MODEL_INPUT_COLUMN_NAME].tolist(), max_length=context_size,
+                              truncation=True)[MODEL_INPUT_IDS]
+    batches = [all_input_ids[i:i + batch_size] for i in range(0, num_examples - batch_size + 1, batch_size)]
+    return {f'generate/batch_{batch_size}': measure(lambda batch: generate_batch(model, tokenizer, batch), batches,
+                                                    batch_size)}
+
+
+def bench_metrics(sizes, num_repeats):
+    """
+    per-example BLEU and ROUGE scores (BERTscore needs to download its model, so it is not benchmarked)
+    """
+    from metric_engine import calc_bleu_scores, calc_rouge_scores
+    results = {}
+    for num_rows in sizes:
+        posts_df = make_synthetic_posts_df(num_rows, seed=1)
+        pairs = list(zip(posts_df[ARTICLE_TITLE_COLUMN_NAME], posts_df[POST_TEST_COLUMN_NAME]))
+        results[f'bleu/{num_rows}'] = measure(calc_bleu_scores, [pairs] * num_repeats, num_rows)
+        results[f'rouge/{num_rows}'] = measure(calc_rouge_scores, [pairs] * num_repeats, num_rows)
+    return results
+
+
+def run_benchmarks(stages, sizes, num_repeats, model_name=None, num_model_examples=256, batch_size=16,
+                   context_size=512):
+    """
+    runs the benchmarks of the pipeline stages offline, on recorded HTML fixtures, synthetic posts and a tiny mT5
+    :param stages: names of the stages to run (from STAGES)
+    :param sizes: numbers of rows of the synthetic posts for the data stages
+    :param num_repeats: number of repeats of every measurement
+    :param model_name: pretrained model (or local dir) for the tokenize/generate stages (if None a tiny mT5 is made)
+    :param num_model_examples: number of examples for the tokenize/generate stages
+    :param batch_size: generation batch size
+    :param context_size: max number of input tokens
+    :return: dictionary of the run metadata and of the results of every benchmark
+    """
+    import torch
+    import transformers
+    results = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        if 'extract' in stages:
+            results.update(bench_extract(num_repeats * 10))
+        if 'preprocess' in stages:
+            results.update(bench_preprocess(sizes, num_repeats, work_dir))
+        if 'near_duplicates' in stages:
+            results.update(bench_near_duplicates(sizes, num_repeats))
+        if 'model_inputs' in stages:
+            results.update(bench_model_inputs(sizes, num_repeats))
+        if 'metrics' in stages:
+            results.update(bench_metrics(sizes, num_repeats))
+        if 'tokenize' in stages or 'generate' in stages:
+            if model_name is None:
+                model, tokenizer = make_tiny_mt5(os.path.join(work_dir, 'tiny_mt5'))
+            else:
+                model = transformers.MT5ForConditionalGeneration.from_pretrained(model_name).eval()
+                tokenizer = transformers.MT5Tokenizer.from_pretrained(model_name)
+            if 'tokenize' in stages:
+                results.update(bench_tokenize(tokenizer, num_model_examples, num_repeats, context_size))
+            if 'generate' in stages:
+                results.update(bench_generate(model, tokenizer, num_model_examples, batch_size, context_size))
+    meta = {'python': platform.python_version(), 'platform': platform.platform(), 'cpu_count': os.cpu_count(),
+            'torch': torch.__version__, 'transformers': transformers.__version__, 'model': model_name or 'tiny_mt5',
+            'time': time.strftime('%Y-%m-%d %H:%M:%S')}
+    return {'meta': meta, 'results': results}
+
+
+def compare_to_baseline(results, baseline_results, tolerance=0.1):
+    """
+    compares benchmark results to stored baseline results
+    :param results: results of run_benchmarks
+    :param baseline_results: baseline results of run_benchmarks
+    :param tolerance: relative change allowed before a benchmark is considered a regression
+    :return: list of (benchmark name, throughput ratio, peak memory ratio, is regression) of the benchmarks in both
+    """
+    comparison = []
+    for name, result in results['results'].items():
+        baseline_result = baseline_results['results'].get(name)
+        if baseline_result is None:
+            continue
+        throughput_ratio = result['items_per_sec'] / baseline_result['items_per_sec']
+        memory_ratio = result['peak_memory_mb'] / max(baseline_result['peak_memory_mb'], 1e-6)
+        is_regression = throughput_ratio < 1 - tolerance or memory_ratio > 1 + tolerance
+        comparison.append((name, throughput_ratio, memory_ratio, is_regression))
+    return comparison
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--stages', type=str, nargs='+', choices=STAGES, help='stages to benchmark', default=STAGES)
+    parser.add_argument('--sizes', '-s', type=int, nargs='+', help='numbers of rows for the data stages',
+                        default=[1000, 10000])
+    parser.add_argument('--num_repeats', '-r', type=int, help='number of repeats per measurement', default=3)
+    parser.add_argument('--model_name', '-n', type=str, help='model for tokenize/generate (default: tiny mT5)')
+    parser.add_argument('--num_model_examples', type=int, help='number of examples for tokenize/generate',
+                        default=256)
+    parser.add_argument('--batch_size', '-b', type=int, help='generation batch size', default=GENERATION_BATCH_SIZE)
+    parser.add_argument('--context_size', '-c', type=int, help='max number of input tokens', default=512)
+    parser.add_argument('--output', '-o', type=str, help='path to write the results json to')
+    parser.add_argument('--baseline', type=str, help='path to a results json to compare to')
+    parser.add_argument('--tolerance', type=float, help='relative change allowed before a regression', default=0.1)
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    results = run_benchmarks(args.stages, args.sizes, args.num_repeats, args.model_name, args.num_model_examples,
+                             args.batch_size, args.context_size)
+    for name, result in results['results'].items():
+        print(f"{name:40} {result['items_per_sec']:12.1f} items/s  p50 {result['p50_ms']:9.2f} ms  "
+              f"p95 {result['p95_ms']:9.2f} ms  peak {result['peak_memory_mb']:8.1f} MB")
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as f:
+            baseline_results = json.load(f)
+        comparison = compare_to_baseline(results, baseline_results, args.tolerance)
+        for name, throughput_ratio, memory_ratio, is_regression in comparison:
+            print(f"{name:40} throughput x{throughput_ratio:.2f}  peak memory x{memory_ratio:.2f}"
+                  f"{'  REGRESSION' if is_regression else ''}")
+        if any(is_regression for *_, is_regression in comparison):
+            sys.exit(1)
@@ -0,0 +1,55 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from consts import *
+
+HEBREW_WORDS = ['הממשלה', 'החליטה', 'היום', 'על', 'העלאת', 'מחירי', 'החשמל', 'ב', 'אחוזים', 'מה', 'שקרה', 'אחרי',
+                'המשחק', 'לא', 'תאמינו', 'הכוכב', 'חשף', 'את', 'הסוד', 'של', 'המדינה', 'בישראל', 'חדש', 'מחקר',
+                'מגלה', 'כי', 'קפה', 'משפר', 'זיכרון', 'מזג', 'האוויר', 'גשם', 'סוף', 'שבוע', 'עם', 'הצבא', 'תל',
+                'אביב', 'ירושלים', 'הכנסת', 'השר', 'אמר', 'זה', 'לא', 'מה', 'שחשבתם', 'כן', 'כמעט', 'בכלל']
+
+
+def make_sentences(rng, num_rows, min_words, max_words):
+    """
+    creates random Hebrew sentences
+    :param rng: numpy random generator
+    :param num_rows: number of sentences
+    :param min_words: min number of words in a sentence
+    :param max_words: max number of words in a sentence
+    :return: list of sentences
+    """
+    lengths = rng.integers(min_words, max_words + 1, num_rows)
+    word_idxs = rng.integers(0, len(HEBREW_WORDS), lengths.sum())
+    words = np.array(HEBREW_WORDS, dtype=object)[word_idxs]
+    bounds = np.concatenate([[0], np.cumsum(lengths)])
+    return [' '.join(words[bounds[i]:bounds[i + 1]]) for i in range(num_rows)]
+
+
+def make_synthetic_posts_df(num_rows, seed=0, body_length=(80, 400)):
+    """
+    creates a synthetic posts dataframe in the format of the scraped posts csv, with a share of rows hitting every
+    filter and cleaning rule
+    :param num_rows: number of rows
+    :param seed: random seed
+    :param body_length: min and max number of words in an article body
+    :return: posts dataframe
+    """
+    rng = np.random.default_rng(seed)
+    art_titles = make_sentences(rng, num_rows, 4, 16)
+    post_texts = make_sentences(rng, num_rows, 1, 24)
+    bodies = make_sentences(rng, num_rows, *body_length)
+    for i in rng.choice(num_rows, num_rows // 10, replace=False):
+        post_texts[i] = art_titles[i].split(' ')[0]
+    for i in rng.choice(num_rows, num_rows // 10, replace=False):
+        art_titles[i] = f'{art_titles[i]} | {NEWSPAPER_NAME_STRINGS[i % len(NEWSPAPER_NAME_STRINGS)]}'
+    for i in rng.choice(num_rows, num_rows // 50, replace=False):
+        art_titles[i] = 'Page not found'
+    for i in rng.choice(num_rows, num_rows // 50, replace=False):
+        post_texts[i] = f'{post_texts[i]} {POST_STRINGS_TO_REMOVE[0]}'
+    for i in rng.choice(num_rows, num_rows // 50, replace=False):
+        post_texts[i] = f'{post_texts[i]} בתגובות'
+    return pd.DataFrame({ARTICLE_TITLE_COLUMN_NAME: art_titles, BODY_COLUMN_NAME: bodies,
+                         POST_TEST_COLUMN_NAME: post_texts})
@@ -0,0 +1,42 @@
+import os
+import sys
+import io
+import numpy as np
+import torch
+import transformers
+import sentencepiece as spm
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from synthetic_data import HEBREW_WORDS, make_sentences
+
+TINY_MT5_CONFIG = {'d_model': 64, 'd_ff': 128, 'd_kv': 16, 'num_heads': 4, 'num_layers': 2, 'num_decoder_layers': 2}
+TINY_VOCAB_SIZE = 128
+
+
+def make_tiny_mt5(output_dir, seed=0):
+    """
+    creates a tiny randomly initialized mT5 model with a sentencepiece tokenizer trained on synthetic Hebrew text, so
+    tokenization and generation can be benchmarked offline (the speed is not representative of mt5-base, but changes
+    in the surrounding code show up)
+    :param output_dir: dir to save the model and tokenizer to (loadable with from_pretrained)
+    :param seed: random seed of the model weights and the training text
+    :return: the model and the tokenizer
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    sentences = make_sentences(np.random.default_rng(seed), 2000, 4, 24) + HEBREW_WORDS + ['question:', 'context:']
+    model_proto = io.BytesIO()
+    spm.SentencePieceTrainer.train(sentence_iterator=iter(sentences), model_writer=model_proto,
+                                   vocab_size=TINY_VOCAB_SIZE, pad_id=0, eos_id=1, unk_id=2, bos_id=-1,
+                                   character_coverage=1.0, hard_vocab_limit=False, minloglevel=2)
+    vocab_path = os.path.join(output_dir, 'spiece.model')
+    with open(vocab_path, 'wb') as f:
+        f.write(model_proto.getvalue())
+    tokenizer = transformers.MT5Tokenizer(vocab_path, legacy=True)
+    config = transformers.MT5Config(vocab_size=len(tokenizer), decoder_start_token_id=tokenizer.pad_token_id,
+                                    **TINY_MT5_CONFIG)
+    torch.manual_seed(seed)
+    model = transformers.MT5ForConditionalGeneration(config)
+    model.eval()
+    model.save_pretrained(output_dir)
+    tokenizer.save_pretrained(output_dir)
+    return model, tokenizer
@@ -1,8 +1,8 @@
-import re
-import html
+import os
 import json
-import urllib
 from consts import *
+from post_index import PostIndex
+from post_parsing import get_external_link, get_bait, SnapshotWriter
 from tqdm import tqdm
 from datetime import datetime
 from facebook_page_scraper import Facebook_scraper
@@ -16,11 +16,20 @@ class ClickbaitScraper(Facebook_scraper):
     Wrapper class for Facebook_scraper class to scrape clickbait posts from a page
     """
 
-    def __init__(self, num_posts=10):
+    def __init__(self, num_posts=10, known_post_ids=None):
+        """
+        :param num_posts: max number of posts to scrape
+        :param known_post_ids: ids of the posts scraped in previous runs. Scrolling stops once
+        CLICKBAIT_KNOWN_POSTS_TO_STOP of them are reached, since the feed is ordered from new to old (a pinned old
+        post alone does not stop it)
+        """
         super().__init__(AMLK_PAGE_NAME, num_posts, browser='firefox')
         self.__data_dict = {}
         self.__layout = None
         self.__extracted_post = set()
+        self.__known_post_ids = known_post_ids or set()
+        self.__num_known_posts_reached = 0
+        self.__snapshot_writer = None
 
     def __start_driver(self):
         """
@@ -42,39 +51,6 @@ class ClickbaitScraper(Facebook_scraper):
         except Exception as ex:
             print(f"Error at handle_popup : {ex}")
 
-    def get_external_link(self, post):
-        """
-        gets the external link from a post
-        :param post: post element
-        :return: external link string
-        """
-        html_text = post.get_attribute("innerHTML")
-        link = re.search(LINK_PATTERN, html_text).group(1)
-        return html.unescape(urllib.parse.unquote(link))
-
-    def get_bait(self, post):
-        """
-        gets the clickbait title from a post
-        :param post: post element
-        :return: clickbait string
-        """
-        html_text = post.get_attribute("innerHTML")
-        try:
-            res = re.findall(BAIT_PATTERN_1, html_text)
-            assert len(res) > 1
-            bait = html.unescape(res[-1])
-            if bait == '':
-                res = re.findall(BAIT_PATTERN_2, html_text)
-                assert len(res) > 1
-                bait = html.unescape(res[-1])
-            return bait
-        except:
-            res = re.findall(BAIT_PATTERN_3, html_text)
-            if len(res) == 0:
-                raise Exception("No bait found")
-            bait = html.unescape(res[0])
-            return bait
-
     def __remove_duplicates(self, all_posts):
         """
         takes a list of posts and removes duplicates from it and returns the list
@@ -97,11 +73,20 @@ class ClickbaitScraper(Facebook_scraper):
         for post in all_posts:
             try:
                 status, post_url, link_element = Finder._Finder__find_status(post, self.__layout)
-                if post_url is None:
+                if post_url is None or status in self.__data_dict:
+                    continue
+                if status in self.__known_post_ids:
+                    self.__num_known_posts_reached += 1
+                    continue
+                if self.__snapshot_writer is not None:
+                    self.__snapshot_writer.write(status, post_url, self.__layout, post.get_attribute("innerHTML"))
+                    self.__data_dict[status] = {"post_url": post_url}
                     continue
                 post_content = Finder._Finder__find_content(post, self.__driver, self.__layout)
-                external_link = self.get_external_link(post)
-                bait = self.get_bait(post)
+                # a single WebDriver round trip for the HTML of the post
+                html_text = post.get_attribute("innerHTML")
+                external_link = get_external_link(html_text)
+                bait = get_bait(html_text)
 
                 self.__data_dict[status] = {
                     "content": post_content,
@@ -114,9 +99,31 @@ class ClickbaitScraper(Facebook_scraper):
 
     def get_clickbaits(self):
         """
-        Scrolls down the page and extracts clickbait titles and links
+        Scrolls down the page and extracts clickbait titles and links, until posts_count posts are extracted or the
+        posts scraped in previous runs are reached
         :return: dictionary of clickbait titles and links
         """
+        self.__scroll_feed()
+        return self.__data_dict
+
+    def capture_snapshot(self, snapshot_path):
+        """
+        Scrolls down the page like get_clickbaits, but only saves the raw HTML of every post to a snapshot file
+        (parsed later by post_parsing.parse_snapshot), keeping the browser session as short as possible
+        :param snapshot_path: path to the snapshot file
+        :return: number of captured posts
+        """
+        self.__snapshot_writer = SnapshotWriter(snapshot_path)
+        try:
+            self.__scroll_feed()
+        finally:
+            self.__snapshot_writer.close()
+        return self.__snapshot_writer.num_posts
+
+    def __scroll_feed(self):
+        """
+        Scrolls down the page, handling the posts found after every scroll with _find_clickbait_elements
+        """
         self.__start_driver()
         self.__driver.get(self.URL)
         Finder._Finder__accept_cookies(self.__driver)
@@ -127,7 +134,8 @@ class ClickbaitScraper(Facebook_scraper):
         self.__handle_popup(self.__layout)
 
         pb = tqdm(total=self.posts_count)
-        while len(self.__data_dict) <= self.posts_count:
+        while len(self.__data_dict) <= self.posts_count and \
+                self.__num_known_posts_reached < CLICKBAIT_KNOWN_POSTS_TO_STOP:
             pb.n = min(len(self.__data_dict), self.posts_count)
             pb.refresh()
             self.__handle_popup(self.__layout)
@@ -137,17 +145,50 @@ class ClickbaitScraper(Facebook_scraper):
         pb.refresh()
         pb.close()
         Utilities._Utilities__close_driver(self.__driver)
-        return self.__data_dict
 
 
-def save_clickbaits(data_dir, num_posts):
+def load_known_post_ids(data_dir):
+    """
+    :param data_dir: path to a posts directory
+    :return: set of the ids of the posts in the json files of the posts dir (read through the post index, so only new
+    files are parsed)
+    """
+    post_index = PostIndex(os.path.join(data_dir, SCRAPER_STATE_DIR_NAME, POST_INDEX_NAME))
+    post_index.update(data_dir)
+    post_index.save()
+    return post_index.get_post_ids()
+
+
+def save_clickbaits(data_dir, num_posts, incremental=True):
     """
     Scrapes this.is.amlk and saves clickbaits in a json file
     :param data_dir: directory to save the json file
-    :param num_posts: number of posts to scrape
+    :param num_posts: max number of posts to scrape
+    :param incremental: if True only posts newer than the posts already saved in the dir are scraped
     """
-    scraper = ClickbaitScraper(num_posts)
+    known_post_ids = load_known_post_ids(data_dir) if incremental else set()
+    scraper = ClickbaitScraper(num_posts, known_post_ids)
     data = scraper.get_clickbaits()
+    if len(data) == 0:
+        print('No new posts')
+        return
     date = datetime.now().strftime("%Y%m%d%H%M%S")
     with open(f'{data_dir}/{date}.json', 'w') as f:
         json.dump(data, f, indent=3, ensure_ascii=False)
+    print(f'Saved {len(data)} new posts')
+
+
+def capture_clickbaits(data_dir, num_posts, incremental=True):
+    """
+    Scrolls this.is.amlk and saves the raw HTML of the posts to a compressed snapshot in the snapshots dir of the
+    posts dir (see post_parsing.parse_snapshots for turning it into a posts json file)
+    :param data_dir: path to the posts directory
+    :param num_posts: max number of posts to capture
+    :param incremental: if True only posts newer than the posts already saved in the dir are captured
+    """
+    known_post_ids = load_known_post_ids(data_dir) if incremental else set()
+    scraper = ClickbaitScraper(num_posts, known_post_ids)
+    date = datetime.now().strftime("%Y%m%d%H%M%S")
+    snapshot_path = os.path.join(data_dir, SNAPSHOT_DIR_NAME, f'{date}{SNAPSHOT_EXTENSION}')
+    num_captured = scraper.capture_snapshot(snapshot_path)
+    print(f'Captured {num_captured} new posts to {snapshot_path}')
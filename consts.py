@@ -15,10 +15,22 @@ ARTICLE_TITLE_STRINGS_TO_REMOVE = ["<.*>", "|", "<", ">"]
 MAX_TITLE_POST_TEXT_SIMILAR_FACTOR = 0.6
 
 MODEL_INPUT_FORMAT = "question: {} context: {}"
+SENTENCEPIECE_WORD_MARK = '\u2581'
+HEBREW_PREFIX_LETTERS = 'והבלמשכ'
+BM25_K1 = 1.5
+BM25_B = 0.75
 BAD_TOKENS = ['<extra_id_0>', '<extra_id_40>', '<extra_id_1>']
 MODEL_INPUT_IDS = 'input_ids'
 MODEL_ATTENTION_MASK = 'attention_mask'
+LENGTH_COLUMN_NAME = 'length'
+LABEL_PAD_TOKEN_ID = -100
 MAX_GENERATION_LENGTH = 50
+GENERATION_BATCH_SIZE = 16
+BERTSCORE_BATCH_SIZE = 64
+METRIC_CHUNK_SIZE = 1000
+METRIC_SCORES_CACHE_NAME = 'metric_scores_cache.jsonl'
+EVALUATION_CHUNK_SIZE = 500
+EVALUATION_CHECKPOINT_NAME = 'checkpoint.json'
 
 MT5_MODELS_DICT = {'mb': 'google/mt5-base',
                    'ml': 'google/mt5-large',
@@ -27,14 +39,67 @@ MT5_MODELS_DICT = {'mb': 'google/mt5-base',
 PADDING = "max_length"
 TRAIN_CSV_PATH = "train.csv"
 VALIDATION_CSV_PATH = "val.csv"
+TOKENIZATION_CACHE_DIR = "tokenization_cache"
 
 AMLK_PAGE_NAME = "this.is.amlk"
 LINK_PATTERN = 'href="https://l.facebook.com/l.php\?..(.*?)\&amp\;'
 BAIT_PATTERN_1 = '<div class="xdj266r x11i5rnm xat24cr x1mh8g0r x1vvkbs x126k92a"><div dir="auto" style="text-align: ?start;?">(.*?)<'
 BAIT_PATTERN_2 = '<div class="xdj266r x11i5rnm xat24cr x1mh8g0r x1vvkbs x126k92a"><div dir="auto" style="text-align: ?start;?">.*?</span>(.*?)<'
 BAIT_PATTERN_3 = ' -webkit-box;"><span dir="auto">(.*?)<'
+CLICKBAIT_KNOWN_POSTS_TO_STOP = 3
+POST_CONTENT_SELECTORS = {'old': '.userContent', 'new': '[data-ad-preview="message"]'}
+SNAPSHOT_DIR_NAME = 'snapshots'
+SNAPSHOT_EXTENSION = '.jsonl.gz'
+SNAPSHOT_COMPRESS_LEVEL = 1
+SNAPSHOT_PARSE_CHUNK_SIZE = 64
 
 TMI_PREFIX = 'tmi.maariv.co.il'
 WALLA_PREFIX = 'walla.co.il'
 MAKO_PREFIX = 'mako.co'
 ISRAELHAYOM_PREFIX = 'israelhayom.co.il'
+DOMAIN_CONCURRENCY_LIMITS = {TMI_PREFIX: 4,
+                             WALLA_PREFIX: 4,
+                             MAKO_PREFIX: 4,
+                             ISRAELHAYOM_PREFIX: 2}
+BROWSER_POOL_SIZE = 2
+
+HTTP_TIMEOUT = 15
+HTTP_MAX_RETRIES = 3
+HTTP_BACKOFF_FACTOR = 0.5
+HTTP_RETRY_STATUS_CODES = [429, 500, 502, 503, 504]
+HTTP_POOL_SIZE = 4
+HOST_MIN_REQUEST_INTERVAL = 0.2
+
+SCRAPER_STATE_DIR_NAME = 'scraper_state'
+CACHE_DIR_NAME = 'html_cache'
+CACHE_TTL = 7 * 24 * 60 * 60
+CACHE_MAX_AGE = 180 * 24 * 60 * 60
+CACHE_MAX_SIZE = 2 * 2 ** 30
+
+LINK_STATUS_DONE = 'done'
+LINK_STATUS_FAILED = 'failed'
+LINK_STATUS_SKIPPED = 'skipped'
+
+SHORT_LINKS_STORE_NAME = 'short_links.json'
+RESOLVE_TIMEOUT = 5
+RESOLVE_NUM_WORKERS = 4
+MAX_REDIRECT_HOPS = 5
+POST_INDEX_NAME = 'post_index.json'
+
+SHINGLE_SIZE = 5
+MINHASH_NUM_PERMUTATIONS = 128
+LSH_NUM_BANDS = 16
+NEAR_DUPLICATE_THRESHOLD = 0.8
+TEST_CSV_PATH = "test.csv"
+
+SERVER_HOST = '127.0.0.1'
+SERVER_PORT = 8000
+SERVER_MAX_BATCH_SIZE = GENERATION_BATCH_SIZE
+SERVER_MAX_BATCH_DELAY = 0.01
+SERVER_MAX_QUEUE_SIZE = 64
+SERVER_REQUEST_TIMEOUT = 10
+SERVER_LATENCY_WINDOW_SIZE = 1000
+
+METRICS_PREFIX = 'amlk'
+LATENCY_HISTOGRAM_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+PROFILE_NUM_FUNCTIONS = 30
@@ -0,0 +1,106 @@
+import re
+import math
+from collections import Counter
+from consts import *
+
+SENTENCE_END_PATTERN = re.compile(r'(?<=[.!?:;])\s+|\n+')
+TERM_PATTERN = re.compile(r'\w+')
+
+
+def split_sentences(text):
+    """
+    splits text into sentences at sentence ending punctuation followed by whitespace, and at line breaks
+    :param text: the text
+    :return: list of non empty sentences
+    """
+    return [sentence.strip() for sentence in SENTENCE_END_PATTERN.split(text) if len(sentence.strip()) > 0]
+
+
+def get_terms(text):
+    """
+    :param text: the text
+    :return: list of the terms of the text: its words, and for words starting with a Hebrew prefix letter (ו, ה, ב, ל,
+    מ, ש, כ) also the word without it, so that e.g. "בממשלה" matches "הממשלה"
+    """
+    terms = []
+    for word in TERM_PATTERN.findall(text.lower()):
+        terms.append(word)
+        if len(word) > 3 and word[0] in HEBREW_PREFIX_LETTERS:
+            terms.append(word[1:])
+    return terms
+
+
+def rank_sentences_bm25(query, sentences, k1=BM25_K1, b=BM25_B):
+    """
+    scores the sentences of an article by their BM25 relevance to the query, where the sentences of the article are
+    the document collection
+    :param query: the query text (the question)
+    :param sentences: list of sentences
+    :param k1: BM25 term frequency saturation
+    :param b: BM25 length normalization
+    :return: list of BM25 scores (aligned with the sentences)
+    """
+    sentences_terms = [Counter(get_terms(sentence)) for sentence in sentences]
+    if len(sentences_terms) == 0:
+        return []
+    avg_length = max(sum(sum(terms.values()) for terms in sentences_terms) / len(sentences_terms), 1)
+    query_terms = set(get_terms(query))
+    document_frequencies = Counter(term for terms in sentences_terms for term in query_terms & terms.keys())
+    idfs = {term: math.log(1 + (len(sentences) - df + 0.5) / (df + 0.5)) for term, df in document_frequencies.items()}
+    scores = []
+    for terms in sentences_terms:
+        length_norm = k1 * (1 - b + b * sum(terms.values()) / avg_length)
+        scores.append(sum(idf * terms[term] * (k1 + 1) / (terms[term] + length_norm)
+                          for term, idf in idfs.items() if term in terms))
+    return scores
+
+
+def select_relevant_sentences(titles, bodies, tokenizer, context_size):
+    """
+    reduces every article body to its sentences most relevant to the question (the article title), within the token
+    budget left by the question. Sentences are added by decreasing BM25 score (earlier sentences first on ties) while
+    they fit, and kept in their original order. Bodies which already fit in the budget are kept as is
+    :param titles: article titles
+    :param bodies: article bodies
+    :param tokenizer: the tokenizer (for counting the tokens of the question and of the sentences)
+    :param context_size: max number of tokens of a model input
+    :return: list of reduced bodies (non string bodies are kept as is)
+    """
+    question_lengths = [len(input_ids) for input_ids in
+                        tokenizer([MODEL_INPUT_FORMAT.format(title, '') for title in titles])[MODEL_INPUT_IDS]]
+    reduced_bodies = []
+    for title, body, question_length in zip(titles, bodies, question_lengths):
+        if not isinstance(body, str):
+            reduced_bodies.append(body)
+            continue
+        budget = context_size - question_length
+        if len(tokenizer.tokenize(body)) <= budget:
+            reduced_bodies.append(body)
+            continue
+        sentences = split_sentences(body)
+        scores = rank_sentences_bm25(title if isinstance(title, str) else '', sentences)
+        selected_idxs = []
+        for i in sorted(range(len(sentences)), key=lambda i: (-scores[i], i)):
+            num_tokens = len(tokenizer.tokenize(sentences[i]))
+            # the best sentence is always kept (it is trimmed later if it does not fit on its own)
+            if num_tokens <= budget or len(selected_idxs) == 0:
+                selected_idxs.append(i)
+                budget -= num_tokens
+            if budget <= 0:
+                break
+        reduced_bodies.append(' '.join(sentences[i] for i in sorted(selected_idxs)))
+    return reduced_bodies
+
+
+def reduce_article_bodies(df, tokenizer, context_size):
+    """
+    replaces the article bodies in the dataframe with their sentences most relevant to the question (see
+    select_relevant_sentences), before building the model inputs
+    :param df: dataframe containing all examples
+    :param tokenizer: the tokenizer
+    :param context_size: max number of tokens of a model input
+    :return: dataframe with reduced article bodies
+    """
+    df[BODY_COLUMN_NAME] = select_relevant_sentences(df[ARTICLE_TITLE_COLUMN_NAME], df[BODY_COLUMN_NAME], tokenizer,
+                                                     context_size)
+    return df
@@ -1,7 +1,23 @@
+import os
 import argparse
 import numpy as np
+from collections import Counter
 import pandas as pd
 from consts import *
+from text_rules import RemovalRuleSet, MatchRuleSet
+from near_duplicates import find_near_duplicate_clusters
+from instrumentation import timer, increment, write_report, profiled
+
+BAD_ARTICLE_TITLE_RULES = MatchRuleSet(BAD_ART_TITLE_STRINGS_REG)
+BAD_POST_TEXT_RULES = MatchRuleSet(BAD_POST_TEXT_STRINGS_REG)
+ARTICLE_TITLE_REMOVAL_RULES = RemovalRuleSet(NEWSPAPER_NAME_STRINGS + ARTICLE_TITLE_STRINGS_TO_REMOVE)
+POST_TEXT_REMOVAL_RULES = RemovalRuleSet(POST_STRINGS_TO_REMOVE)
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
 
 
 def filter_posts_by_length(all_posts_df, max_length=20):
@@ -11,11 +27,8 @@ def filter_posts_by_length(all_posts_df, max_length=20):
     :param max_length: maximum acceptable length of post (in words) 
     :return: filtered dataframe
     """
-    all_posts_df['post_split'] = all_posts_df[POST_TEST_COLUMN_NAME].str.split(' ')
-    short_post_text_df = all_posts_df[all_posts_df['post_split'].str.len() <= max_length]
-    short_post_text_df = short_post_text_df[short_post_text_df['post_split'].str.len() > 0]
-    short_post_text_df = short_post_text_df.drop(columns=['post_split'])
-    return short_post_text_df
+    post_lengths = all_posts_df[POST_TEST_COLUMN_NAME].str.split(' ').str.len()
+    return all_posts_df[(post_lengths <= max_length) & (post_lengths > 0)]
 
 
 def filter_invalid_article_titles(posts_df):
@@ -26,7 +39,7 @@ def filter_invalid_article_titles(posts_df):
     """
     posts_df = posts_df[posts_df[ARTICLE_TITLE_COLUMN_NAME] != FAILED_TO_OPEN_VAL]
     posts_df = posts_df[posts_df[ARTICLE_TITLE_COLUMN_NAME] != 'None']
-    posts_df = posts_df[posts_df[ARTICLE_TITLE_COLUMN_NAME].str.contains(BAD_ART_TITLE_STRINGS_REG) == False]
+    posts_df = posts_df[~BAD_ARTICLE_TITLE_RULES.find_matches(posts_df[ARTICLE_TITLE_COLUMN_NAME])]
     return posts_df
 
 
@@ -36,10 +49,24 @@ def filter_posts_with_bad_strings(posts_df):
     :param posts_df: posts dataframe
     :return: filtered dataframe
     """
-    posts_df = posts_df[posts_df[POST_TEST_COLUMN_NAME].str.contains(BAD_POST_TEXT_STRINGS_REG) == False]
+    posts_df = posts_df[~BAD_POST_TEXT_RULES.find_matches(posts_df[POST_TEST_COLUMN_NAME])]
     return posts_df.reset_index(drop=True)
 
 
+def is_post_contained_in_art_title(art_title, post_text):
+    """
+    checks if the post text is mostly contained in the article title
+    :param art_title: article title
+    :param post_text: post text
+    :return: True if the post text is a substring of the title or most of its words appear in the title
+    """
+    if post_text in art_title:
+        return True
+    post_text_list = post_text.split(" ")
+    post_art_title_overlap = set(art_title.split(" ")).intersection(post_text_list)
+    return len(post_art_title_overlap) > MAX_TITLE_POST_TEXT_SIMILAR_FACTOR * len(post_text_list)
+
+
 def filter_posts_contained_in_art_title(posts_df):
     """
     filters out most posts with text that is mostly contained in the title (suggesting this is not
@@ -47,37 +74,30 @@ def filter_posts_contained_in_art_title(posts_df):
     :param posts_df: posts dataframe
     :return: filtered dataframe
     """
-    good_idxs_mask = np.full(len(posts_df), False)
-    for i in range(len(posts_df)):
-        art_title = posts_df[ARTICLE_TITLE_COLUMN_NAME][i]
-        post_text = posts_df[POST_TEST_COLUMN_NAME][i]
-        if post_text in art_title:
-            continue
-        if " " in post_text:
-            post_text_list = post_text.split(" ")
-        else:
-            post_text_list = [post_text]
-        if " " in art_title:
-            art_title_list = art_title.split(" ")
-        else:
-            art_title_list = [art_title]
-        post_art_title_overlap = list(set(art_title_list) & set(post_text_list))
-        if len(post_art_title_overlap) > MAX_TITLE_POST_TEXT_SIMILAR_FACTOR * len(post_text_list):
-            continue
-        good_idxs_mask[i] = True
+    good_idxs_mask = np.array([not is_post_contained_in_art_title(art_title, post_text) for art_title, post_text in
+                               zip(posts_df[ARTICLE_TITLE_COLUMN_NAME].tolist(),
+                                   posts_df[POST_TEST_COLUMN_NAME].tolist())], dtype=bool)
     return posts_df[good_idxs_mask].reset_index(drop=True)
 
 
-def apply_filters(posts_df):
+def apply_filters(posts_df, drop_counts=None):
     """
     applies all filter functions to the posts dataframe
     :param posts_df: posts dataframe
+    :param drop_counts: Counter to add the number of rows dropped by each filter to (optional)
     :return: filtered dataframe
     """
-    posts_df = filter_posts_by_length(posts_df)
-    posts_df = filter_invalid_article_titles(posts_df)
-    posts_df = filter_posts_with_bad_strings(posts_df)
-    posts_df = filter_posts_contained_in_art_title(posts_df)
+    filter_funcs = [filter_posts_by_length, filter_invalid_article_titles, filter_posts_with_bad_strings,
+                    filter_posts_contained_in_art_title]
+    filter_names = ['filter_posts_by_length', 'filter_invalid_article_titles', 'filter_posts_with_bad_strings',
+                    'filter_posts_contained_in_art_title']
+    for filter_name, filter_func in zip(filter_names, filter_funcs):
+        num_rows = len(posts_df)
+        with timer('filter', filter=filter_name):
+            posts_df = filter_func(posts_df)
+        increment('rows_dropped', num_rows - len(posts_df), filter=filter_name)
+        if drop_counts is not None:
+            drop_counts[filter_name] += num_rows - len(posts_df)
     return posts_df
 
 
@@ -87,8 +107,7 @@ def clean_post_text(posts_df):
     :param posts_df: posts dataframe
     :return: dataframe with clean posts
     """
-    for s in POST_STRINGS_TO_REMOVE:
-        posts_df[POST_TEST_COLUMN_NAME] = posts_df[POST_TEST_COLUMN_NAME].str.replace(s, "")
+    posts_df[POST_TEST_COLUMN_NAME] = POST_TEXT_REMOVAL_RULES.apply(posts_df[POST_TEST_COLUMN_NAME])
     return posts_df.reset_index(drop=True)
 
 
@@ -98,8 +117,7 @@ def clean_article_titles(posts_df):
     :param posts_df: posts dataframe
     :return: dataframe with clean article titles
     """
-    for s in NEWSPAPER_NAME_STRINGS + ARTICLE_TITLE_STRINGS_TO_REMOVE:
-        posts_df[ARTICLE_TITLE_COLUMN_NAME] = posts_df[ARTICLE_TITLE_COLUMN_NAME].str.replace(s, '')
+    posts_df[ARTICLE_TITLE_COLUMN_NAME] = ARTICLE_TITLE_REMOVAL_RULES.apply(posts_df[ARTICLE_TITLE_COLUMN_NAME])
     return posts_df
 
 
@@ -109,22 +127,213 @@ def apply_cleaning_funcs(posts_df):
     :param posts_df: posts dataframe
     :return: cleaned dataframe
     """
-    posts_df = clean_article_titles(posts_df)
-    posts_df = clean_post_text(posts_df)
+    with timer('clean', cleaner='clean_article_titles'):
+        posts_df = clean_article_titles(posts_df)
+    with timer('clean', cleaner='clean_post_text'):
+        posts_df = clean_post_text(posts_df)
     return posts_df
 
 
+@timer('find_near_duplicates')
+def find_near_duplicate_posts(posts_df, num_workers=1):
+    """
+    clusters near duplicate examples: posts of syndicated articles (near duplicate bodies) and reposted baits (near
+    duplicate article title and post text)
+    :param posts_df: posts dataframe
+    :param num_workers: number of processes for computing the MinHash signatures
+    :return: array with the cluster id of every row (the position of the first row of its cluster)
+    """
+    union_find = find_near_duplicate_clusters(posts_df[BODY_COLUMN_NAME].tolist(), num_workers=num_workers)
+    titles_and_posts = (posts_df[ARTICLE_TITLE_COLUMN_NAME].astype(str) + ' ' +
+                        posts_df[POST_TEST_COLUMN_NAME].astype(str)).tolist()
+    find_near_duplicate_clusters(titles_and_posts, num_workers=num_workers, union_find=union_find)
+    return union_find.roots()
+
+
+def drop_near_duplicate_posts(posts_df, clusters):
+    """
+    keeps only the first row of every near duplicates cluster
+    :param posts_df: posts dataframe
+    :param clusters: cluster id of every row, as returned from find_near_duplicate_posts
+    :return: dataframe without near duplicates
+    """
+    return posts_df[clusters == np.arange(len(posts_df))].reset_index(drop=True)
+
+
+def split_by_clusters(posts_df, clusters, val_fraction=0.1, test_fraction=0.1, seed=0):
+    """
+    splits the posts to train/validation/test sets such that all the rows of a near duplicates cluster end up in the
+    same set
+    :param posts_df: posts dataframe
+    :param clusters: cluster id of every row, as returned from find_near_duplicate_posts
+    :param val_fraction: approximate fraction of rows in the validation set
+    :param test_fraction: approximate fraction of rows in the test set
+    :param seed: random seed for shuffling the clusters
+    :return: train, validation and test dataframes
+    """
+    cluster_ids, cluster_sizes = np.unique(clusters, return_counts=True)
+    shuffled = np.random.default_rng(seed).permutation(len(cluster_ids))
+    cumulative_sizes = np.cumsum(cluster_sizes[shuffled])
+    test_clusters = cluster_ids[shuffled[cumulative_sizes <= test_fraction * len(posts_df)]]
+    val_clusters = cluster_ids[shuffled[(cumulative_sizes > test_fraction * len(posts_df)) &
+                                        (cumulative_sizes <= (test_fraction + val_fraction) * len(posts_df))]]
+    is_test = np.isin(clusters, test_clusters)
+    is_val = np.isin(clusters, val_clusters)
+    return (posts_df[~is_test & ~is_val].reset_index(drop=True), posts_df[is_val].reset_index(drop=True),
+            posts_df[is_test].reset_index(drop=True))
+
+
+def report_rule_match_counts():
+    """
+    prints the number of rows each filter/cleaning rule matched (accumulated over all calls)
+    """
+    for rules_name, rules in [('Bad article title', BAD_ARTICLE_TITLE_RULES), ('Bad post text', BAD_POST_TEXT_RULES),
+                              ('Article title removal', ARTICLE_TITLE_REMOVAL_RULES),
+                              ('Post text removal', POST_TEXT_REMOVAL_RULES)]:
+        for rule, count in rules.match_counts.most_common():
+            print(f'{rules_name} rule "{rule}": {count} rows')
+
+
+def is_parquet_path(path):
+    """
+    :param path: path to posts file
+    :return: True if the file is a parquet file (which requires pyarrow), False if it is a csv
+    """
+    if not path.endswith('.parquet'):
+        return False
+    if pq is None:
+        raise ImportError("pyarrow is required for reading and writing parquet files")
+    return True
+
+
+def iter_posts_chunks(posts_path, chunk_size=None):
+    """
+    reads the posts file (csv or parquet) in chunks
+    :param posts_path: path to posts file
+    :param chunk_size: number of rows per chunk (if None the whole file is one chunk)
+    :return: generator of posts dataframes
+    """
+    if is_parquet_path(posts_path):
+        if chunk_size is None:
+            yield pd.read_parquet(posts_path)
+            return
+        for batch in pq.ParquetFile(posts_path).iter_batches(batch_size=chunk_size):
+            yield batch.to_pandas()
+    elif chunk_size is None:
+        yield pd.read_csv(posts_path)
+    else:
+        yield from pd.read_csv(posts_path, chunksize=chunk_size)
+
+
+class PostsChunkWriter:
+    """
+    Appends chunks of posts to a csv or parquet file, keeping a running index across the chunks
+    """
+
+    def __init__(self, output_path):
+        self.output_path = output_path
+        self.num_rows = 0
+        self.__parquet_writer = None
+        self.__empty_table = None
+
+    def write(self, posts_df):
+        """
+        appends a chunk of posts to the output file
+        :param posts_df: posts dataframe (with index starting from 0)
+        """
+        posts_df = posts_df.set_axis(pd.RangeIndex(self.num_rows, self.num_rows + len(posts_df)))
+        if is_parquet_path(self.output_path):
+            if self.__parquet_writer is None:
+                table = pa.Table.from_pandas(posts_df, preserve_index=True)
+                if len(posts_df) == 0:
+                    # the columns of an empty chunk have no types yet, so the writer waits for a non-empty chunk
+                    self.__empty_table = table
+                    return
+                self.__parquet_writer = pq.ParquetWriter(self.output_path, table.schema)
+            else:
+                table = pa.Table.from_pandas(posts_df, schema=self.__parquet_writer.schema,
+                                             preserve_index=True)
+            self.__parquet_writer.write_table(table)
+        else:
+            posts_df.to_csv(self.output_path, mode='w' if self.num_rows == 0 else 'a', header=self.num_rows == 0)
+        self.num_rows += len(posts_df)
+
+    def close(self):
+        """
+        closes the output file (if all the chunks were empty, writes a parquet file with no rows)
+        """
+        if self.__parquet_writer is not None:
+            self.__parquet_writer.close()
+        elif self.__empty_table is not None:
+            pq.write_table(self.__empty_table, self.output_path)
+
+
+def preprocess_posts(posts_path, output_path, chunk_size=None):
+    """
+    filters and cleans the posts file chunk by chunk, appending each clean chunk to the output file
+    :param posts_path: path to original posts file (csv or parquet)
+    :param output_path: desired path for the clean file (csv or parquet)
+    :param chunk_size: number of rows per chunk (if None the whole file is processed at once)
+    :return: number of clean rows, and Counter of the number of rows dropped by each filter
+    """
+    drop_counts = Counter()
+    writer = PostsChunkWriter(output_path)
+    try:
+        for posts_df in iter_posts_chunks(posts_path, chunk_size):
+            increment('rows_read', len(posts_df))
+            filtered_posts_df = apply_filters(posts_df, drop_counts)
+            writer.write(apply_cleaning_funcs(filtered_posts_df))
+    finally:
+        writer.close()
+    return writer.num_rows, drop_counts
+
+
 def parse_args():
     parser = argparse.ArgumentParser()
-    parser.add_argument('--posts_csv_path', '-p', type=str, help='path to original posts csv')
-    parser.add_argument('--output_path', '-o', type=str, help='desired path for the clean csv')
+    parser.add_argument('--posts_csv_path', '-p', type=str, help='path to original posts csv (or parquet)')
+    parser.add_argument('--output_path', '-o', type=str, help='desired path for the clean csv (or parquet)')
+    parser.add_argument('--num_workers', '-w', type=int, help='number of processes for finding near duplicates',
+                        default=1)
+    parser.add_argument('--chunk_size', '-c', type=int, help='process the posts in chunks of this many rows')
+    parser.add_argument('--drop_near_duplicates', action='store_true', default=False,
+                        help='keep only one example of every cluster of near duplicate examples')
+    parser.add_argument('--split_dir', type=str,
+                        help='if given, writes train/val/test csvs to this dir, keeping near duplicates in one split')
+    parser.add_argument('--val_fraction', type=float, help='fraction of examples for validation', default=0.1)
+    parser.add_argument('--test_fraction', type=float, help='fraction of examples for test', default=0.1)
+    parser.add_argument('--metrics_report', type=str,
+                        help='path to write the run metrics to (Prometheus text format if it ends with .prom, else json)')
+    parser.add_argument('--profile', type=str, help='path to write a cProfile dump of the preprocessing to')
     args = parser.parse_args()
     return args
 
 
 if __name__ == '__main__':
     args = parse_args()
-    orig_posts_df = pd.read_csv(args.posts_csv_path)
-    filtered_posts_df = apply_filters(orig_posts_df)
-    clean_posts_df = apply_cleaning_funcs(filtered_posts_df)
-    clean_posts_df.to_csv(args.output_path)
+    with profiled(args.profile), timer('preprocess_posts'):
+        num_clean_rows, drop_counts = preprocess_posts(args.posts_csv_path, args.output_path, args.chunk_size)
+    for filter_name, num_dropped in drop_counts.items():
+        print(f'{filter_name} dropped {num_dropped} rows')
+    print(f'{num_clean_rows} rows left')
+    report_rule_match_counts()
+    if args.drop_near_duplicates or args.split_dir is not None:
+        if is_parquet_path(args.output_path):
+            clean_posts_df = pd.read_parquet(args.output_path)
+        else:
+            clean_posts_df = pd.read_csv(args.output_path, index_col=0)
+        clusters = find_near_duplicate_posts(clean_posts_df, args.num_workers)
+        print(f'{len(clean_posts_df) - len(np.unique(clusters))} rows are near duplicates of other rows')
+        if args.drop_near_duplicates:
+            clean_posts_df = drop_near_duplicate_posts(clean_posts_df, clusters)
+            clusters = np.arange(len(clean_posts_df))
+            writer = PostsChunkWriter(args.output_path)
+            try:
+                writer.write(clean_posts_df)
+            finally:
+                writer.close()
+        if args.split_dir is not None:
+            os.makedirs(args.split_dir, exist_ok=True)
+            split_dfs = split_by_clusters(clean_posts_df, clusters, args.val_fraction, args.test_fraction)
+            for split_df, split_path in zip(split_dfs, [TRAIN_CSV_PATH, VALIDATION_CSV_PATH, TEST_CSV_PATH]):
+                split_df.to_csv(os.path.join(args.split_dir, split_path))
+    write_report(args.metrics_report)
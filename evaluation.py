@@ -1,63 +1,19 @@
 import argparse
+import heapq
 import json
 import os
+import time
 import numpy as np
 import pandas as pd
-from nltk.translate.bleu_score import sentence_bleu
-from evaluate import load
-from rouge import Rouge
-from utils import merge_article_title_and_body_into_one_for_model_input, load_model_and_tokenizer, \
-    remove_bad_tokens_from_model_output
+import torch
+from tqdm import tqdm
+from metric_engine import MetricEngine
+from context_selection import reduce_article_bodies
+from utils import merge_article_title_and_body_into_one_for_model_input, load_model_and_tokenizer, generate_batch
+from instrumentation import timer, set_gauge, write_report, profiled
 from consts import *
 
 
-def calc_avg_bleu_score(references, predictions, tokenizer):
-    """
-    calculates the BLEU score for each prediction (based on unigram only because of short labels)
-    :param references: the references/labels
-    :param predictions: the predictions
-    :param tokenizer: not used in this function
-    :return: average BLEU score over all examples, and list of individual BLEU scores for each example
-    """
-    blue_scores = [sentence_bleu([r.split()], p.split(), weights=(1, 0, 0, 0)) for r, p in zip(references, predictions)]
-    return np.mean(blue_scores), blue_scores
-
-
-def calc_avg_rouge_scores(references, predictions, tokenizer):
-    """
-    calculates the ROUGE scores (rouge-1, rouge-2, rouge-l) for each prediction (p, r, f)
-    :param references: the references/labels
-    :param predictions: the predictions
-    :param tokenizer: not used in this function
-    :return: average ROUGE scores over all examples, and list of individual ROUGE scores for each example
-    """
-    hyps, refs = map(list, zip(*[[predictions[i], references[i]] for i in range(len(references))]))
-    rouge = Rouge()
-    all_scores = rouge.get_scores(hyps, refs, avg=False)
-    avg_score = rouge.get_scores(hyps, refs, avg=True)
-    return avg_score, all_scores
-
-
-def calc_avg_BERTscore(references, predictions, tokenizer):
-    """
-    calculates the BERTscore for each prediction (p, r, f)
-    :param references: the references/labels
-    :param predictions: the predictions
-    :param tokenizer: the tokenizer used
-    :return: average BERTscore score over all examples, and list of individual BERTscores for each example
-    """
-    bertscore = load("bertscore")
-    all_scores = bertscore.compute(predictions=predictions, references=references, lang="he")
-    avg_score = {'f1': np.mean(all_scores['f1']), 'p': np.mean(all_scores['precision']),
-                 'r': np.mean(all_scores['recall'])}
-    return avg_score, all_scores
-
-
-eval_metric_name_to_func_dict = {'bleu': calc_avg_bleu_score,
-                                 'rouge': calc_avg_rouge_scores,
-                                 'BERTscore': calc_avg_BERTscore}
-
-
 def parse_args():
     parser = argparse.ArgumentParser()
     parser.add_argument('--model_path', '-m', type=str, help='path to the model to evaluate')
@@ -66,47 +22,121 @@ def parse_args():
     parser.add_argument('--test_data_path', '-t', type=str, help='path to the test data to evaluate on')
     parser.add_argument('--output_path', '-o', type=str, help='path to output dir')
     parser.add_argument('--is_baseline', action="store_true")
+    parser.add_argument('--batch_size', '-b', type=int, help='generation batch size', default=GENERATION_BATCH_SIZE)
+    parser.add_argument('--device', type=str, help='device to run the model on (default: GPU if available)')
+    parser.add_argument('--bf16', action="store_true", help='load the model weights in bfloat16')
+    parser.add_argument('--quantize', action="store_true", help='dynamic int8 quantization (CPU only)')
+    parser.add_argument('--context_size', '-c', type=int,
+                        help='trim article bodies and truncate inputs to this number of tokens (default: no limit)')
+    parser.add_argument('--select_context', action="store_true",
+                        help='reduce article bodies to their sentences most relevant to the question (needs -c)')
+    parser.add_argument('--num_workers', type=int, help='number of processes for BLEU and ROUGE', default=1)
+    parser.add_argument('--stream', action="store_true",
+                        help='write predictions and running scores chunk by chunk (resumable with --resume)')
+    parser.add_argument('--chunk_size', type=int, help='number of examples per chunk when streaming',
+                        default=EVALUATION_CHUNK_SIZE)
+    parser.add_argument('--resume', action="store_true", help='continue a streaming evaluation from its last chunk')
+    parser.add_argument('--score_cache_path', type=str,
+                        help=f'path to the per-example scores cache (default: output dir/{METRIC_SCORES_CACHE_NAME})')
+    parser.add_argument('--metrics_report', type=str,
+                        help='path to write the run metrics to (Prometheus text format if it ends with .prom, else json)')
+    parser.add_argument('--profile', type=str, help='path to write a cProfile dump of the evaluation to')
     args = parser.parse_args()
+    if args.select_context and args.context_size is None:
+        parser.error('--select_context needs --context_size')
+    if args.bf16 and args.quantize:
+        parser.error('--bf16 and --quantize can not be used together (quantized models run in float32)')
     return args
 
 
-def generate_predictions(model, tokenizer, data_path):
+def generate_in_length_sorted_batches(model, tokenizer, all_input_ids, batch_size=GENERATION_BATCH_SIZE):
     """
-    generates model predictions for all examples in the data
+    generates model predictions for tokenized model inputs, in batches of inputs of similar length
     :param model: the model
     :param tokenizer: the tokenizer
+    :param all_input_ids: list of input ids lists (one per example)
+    :param batch_size: number of examples to generate for at once
+    :return: predictions (aligned with the inputs), and number of generated tokens
+    """
+    sorted_idxs = np.argsort([len(input_ids) for input_ids in all_input_ids], kind='stable')
+    predictions = [None] * len(all_input_ids)
+    num_generated_tokens = 0
+    for batch_start in tqdm(range(0, len(sorted_idxs), batch_size), desc="Generating"):
+        batch_idxs = sorted_idxs[batch_start:batch_start + batch_size]
+        batch_predictions, num_batch_tokens = generate_batch(model, tokenizer, [all_input_ids[i] for i in batch_idxs])
+        num_generated_tokens += num_batch_tokens
+        for i, prediction in zip(batch_idxs, batch_predictions):
+            predictions[i] = prediction
+    return predictions, num_generated_tokens
+
+
+def get_generation_stats(num_examples, num_generated_tokens, generation_time, batch_size, device):
+    """
+    :return: generation speed statistics dictionary (also printed)
+    """
+    generation_stats = {'examples_per_sec': num_examples / generation_time,
+                        'tokens_per_sec': num_generated_tokens / generation_time,
+                        'batch_size': batch_size, 'device': str(device)}
+    set_gauge('generation_examples_per_sec', generation_stats['examples_per_sec'])
+    set_gauge('generation_tokens_per_sec', generation_stats['tokens_per_sec'])
+    print(f"Generated {num_examples} predictions in {generation_time:.1f}s: "
+          f"{generation_stats['examples_per_sec']:.2f} examples/sec, "
+          f"{generation_stats['tokens_per_sec']:.1f} tokens/sec")
+    return generation_stats
+
+
+def load_test_df(data_path, tokenizer, context_size=None, select_context=False):
+    """
+    loads the test data and builds the model inputs
     :param data_path: path to data csv
-    :return: predictions, references and titles (aligned)
+    :param tokenizer: the tokenizer
+    :param context_size: if given, article bodies are trimmed to fit in this number of tokens
+    :param select_context: if True article bodies are first reduced to their sentences most relevant to the question
+    (needs context_size)
+    :return: test dataframe with the model input column
+    """
+    test_df = pd.read_csv(data_path)
+    if select_context:
+        test_df = reduce_article_bodies(test_df, tokenizer, context_size)
+    return merge_article_title_and_body_into_one_for_model_input(test_df, tokenizer, context_size)
+
+
+def generate_predictions(model, tokenizer, data_path, batch_size=GENERATION_BATCH_SIZE, context_size=None,
+                         select_context=False):
     """
-    test_df = merge_article_title_and_body_into_one_for_model_input(pd.read_csv(data_path))
+    generates model predictions for all examples in the data, in batches of examples of similar length
+    :param model: the model
+    :param tokenizer: the tokenizer
+    :param data_path: path to data csv
+    :param batch_size: number of examples to generate for at once
+    :param context_size: if given, article bodies are trimmed and inputs truncated to this number of tokens
+    :param select_context: if True article bodies are reduced to their sentences most relevant to the question
+    :return: predictions, references and titles (aligned), and generation speed statistics
+    """
+    test_df = load_test_df(data_path, tokenizer, context_size, select_context)
     references = test_df[LABEL_COLUMN_NAME]
     titles = test_df[ARTICLE_TITLE_COLUMN_NAME]
-    predictions = []
-    for i in range(len(references)):
-        context = test_df[MODEL_INPUT_COLUMN_NAME][i]
-        features = tokenizer([context], return_tensors='pt')
-        output = model.generate(input_ids=features[MODEL_INPUT_IDS].to('cuda'),
-                                attention_mask=features[MODEL_ATTENTION_MASK].to('cuda'),
-                                max_length=MAX_GENERATION_LENGTH)
-        decoded_output = tokenizer.decode(output[0], skip_special_tokens=True)
-        predictions.append(remove_bad_tokens_from_model_output(decoded_output))
-    return predictions, references, titles
+    all_input_ids = tokenizer(test_df[MODEL_INPUT_COLUMN_NAME].tolist(), max_length=context_size,
+                              truncation=context_size is not None)[MODEL_INPUT_IDS]
+    start_time = time.perf_counter()
+    predictions, num_generated_tokens = generate_in_length_sorted_batches(model, tokenizer, all_input_ids, batch_size)
+    generation_stats = get_generation_stats(len(predictions), num_generated_tokens, time.perf_counter() - start_time,
+                                            batch_size, model.device)
+    return predictions, references, titles, generation_stats
 
 
-def run_all_eval_metrics(predictions, references, tokenizer):
+def run_all_eval_metrics(predictions, references, tokenizer, metric_engine=None):
     """
-    runs all evaluation metrics' functions on the given references and predictions
+    runs all evaluation metrics on the given references and predictions
     :param predictions: the predictions
     :param references: the references
-    :param tokenizer: the tokenizer (needed for BERTscore)
+    :param tokenizer: not used in this function
+    :param metric_engine: MetricEngine to score with (if None scores in the current process without a persistent cache)
     :return: average evaluation metrics' scores and individual scores for each example
     """
-    eval_metric_avg_scores, eval_metric_all_scores = {}, {}
-    for metric_name in eval_metric_name_to_func_dict:
-        avg_score, all_scores = eval_metric_name_to_func_dict[metric_name](references, predictions, tokenizer)
-        eval_metric_avg_scores[metric_name] = avg_score
-        eval_metric_all_scores[metric_name] = all_scores
-    return eval_metric_avg_scores, eval_metric_all_scores
+    metric_engine = metric_engine or MetricEngine()
+    with timer('score_metrics'):
+        return metric_engine.score(list(predictions), list(references))
 
 
 def write_out_eval_results(eval_results, output_path, output_prefix):
@@ -147,24 +177,194 @@ def write_out_all_predictions_to_csv(predictions_df, output_path, output_prefix)
     predictions_df.to_csv(os.path.join(output_path, f'predictions_{output_prefix}.csv'), encoding='utf8')
 
 
+def find_examples_with_lowest_BERTscore(predictions_dfs, k=20):
+    """
+    finds the k predictions with lowest BERTscore, keeping only k rows in a bounded heap
+    :param predictions_dfs: iterable of predictions dataframes (e.g. the chunks of a streaming evaluation)
+    :param k: number of predictions to find
+    :return: dataframe of the k predictions with lowest BERTscore, sorted by BERTscore (ties keep their order)
+    """
+    # max heap (by negated keys) of the k lowest (score, position) seen so far
+    heap = []
+    position = 0
+    for predictions_df in predictions_dfs:
+        for index, row in zip(predictions_df.index, predictions_df.itertuples(index=False)):
+            item = (-row.BERTscore_f1, -position, index, row)
+            position += 1
+            if len(heap) < k:
+                heapq.heappush(heap, item)
+            elif item[:2] > heap[0][:2]:
+                heapq.heapreplace(heap, item)
+    lowest_items = sorted(heap, key=lambda item: item[:2], reverse=True)
+    return pd.DataFrame([item[3] for item in lowest_items], index=[item[2] for item in lowest_items])
+
+
 def write_out_examples_with_lowest_BERTscore_to_csv(predictions_df, output_path, output_prefix, k=20):
     """
     writes out k predictions with lowest BERTscore from dataframe to csv file
-   :param predictions_df: predictions dataframe
+    :param predictions_df: predictions dataframe, or iterable of predictions dataframes
     :param output_path: output dir path
     :param output_prefix: csv name prefix
     :param k: number of predictions to write out
     """
-    lowest_score_df = predictions_df.sort_values(by=['BERTscore_f1'])[:k]
+    predictions_dfs = [predictions_df] if isinstance(predictions_df, pd.DataFrame) else predictions_df
+    lowest_score_df = find_examples_with_lowest_BERTscore(predictions_dfs, k)
     lowest_score_df.to_csv(os.path.join(output_path, f'predictions_{output_prefix}_lowest_BERScore_{k}.csv'),
                            encoding='utf8')
 
 
-def main(model_path, pretrain_model_name, is_baseline, output_prefix, test_data_path, output_path):
-    model, tokenizer = load_model_and_tokenizer(model_path, pretrain_model_name, is_baseline)
-    predictions, references, titles = generate_predictions(model, tokenizer, test_data_path)
-    eval_metric_avg_scores, eval_metric_all_scores = run_all_eval_metrics(predictions, references, tokenizer)
-    write_out_eval_results(eval_metric_avg_scores, output_path, output_prefix)
+def merge_avg_scores(avg_scores, num_examples, chunk_avg_scores, chunk_num_examples):
+    """
+    merges the average scores of a chunk of examples into the running average scores
+    :param avg_scores: running average scores (nested dictionaries of averages, as returned by run_all_eval_metrics),
+    None if no examples were scored yet
+    :param num_examples: number of examples averaged in avg_scores
+    :param chunk_avg_scores: average scores of the chunk
+    :param chunk_num_examples: number of examples in the chunk
+    :return: average scores of all the examples
+    """
+    if avg_scores is None:
+        return chunk_avg_scores
+    if isinstance(avg_scores, dict):
+        return {name: merge_avg_scores(avg_scores[name], num_examples, chunk_avg_scores[name], chunk_num_examples)
+                for name in avg_scores}
+    return (avg_scores * num_examples + chunk_avg_scores * chunk_num_examples) / (num_examples + chunk_num_examples)
+
+
+class EvaluationCheckpoint:
+    """
+    Progress of a streaming evaluation: the number of chunks whose predictions csv was written and the running average
+    scores of their examples
+    """
+
+    def __init__(self, checkpoint_path, test_data_path, chunk_size, resume=False):
+        """
+        :param checkpoint_path: path to the checkpoint json file
+        :param test_data_path: path to the test data (must match the checkpoint when resuming)
+        :param chunk_size: number of examples per chunk (must match the checkpoint when resuming)
+        :param resume: if True continues from an existing checkpoint, else starts over
+        """
+        self.checkpoint_path = checkpoint_path
+        self.test_data_path = test_data_path
+        self.chunk_size = chunk_size
+        self.num_completed_chunks = 0
+        self.num_examples = 0
+        self.avg_scores = None
+        if resume and os.path.exists(checkpoint_path):
+            with open(checkpoint_path, 'r') as f:
+                checkpoint = json.load(f)
+            if checkpoint['test_data_path'] != test_data_path or checkpoint['chunk_size'] != chunk_size:
+                raise ValueError(f"{checkpoint_path} was written for {checkpoint['test_data_path']} with chunk size "
+                                 f"{checkpoint['chunk_size']}")
+            self.num_completed_chunks = checkpoint['num_completed_chunks']
+            self.num_examples = checkpoint['num_examples']
+            self.avg_scores = checkpoint['avg_scores']
+
+    def add_chunk(self, chunk_avg_scores, chunk_num_examples):
+        """
+        records a completed chunk and saves the checkpoint
+        :param chunk_avg_scores: average scores of the chunk
+        :param chunk_num_examples: number of examples in the chunk
+        """
+        self.avg_scores = merge_avg_scores(self.avg_scores, self.num_examples, chunk_avg_scores, chunk_num_examples)
+        self.num_examples += chunk_num_examples
+        self.num_completed_chunks += 1
+        tmp_path = f'{self.checkpoint_path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'test_data_path': self.test_data_path, 'chunk_size': self.chunk_size,
+                       'num_completed_chunks': self.num_completed_chunks, 'num_examples': self.num_examples,
+                       'avg_scores': self.avg_scores}, f)
+        os.replace(tmp_path, self.checkpoint_path)
+
+
+def iter_predictions_chunks(chunks_dir, num_chunks):
+    """
+    lazily reads the predictions csv of the chunks of a streaming evaluation
+    :param chunks_dir: path to the chunks dir
+    :param num_chunks: number of chunks
+    :return: generator of predictions dataframes
+    """
+    for chunk_idx in range(num_chunks):
+        yield pd.read_csv(os.path.join(chunks_dir, f'chunk_{chunk_idx:05d}.csv'), index_col=0, encoding='utf8')
+
+
+def stream_evaluation(model, tokenizer, test_data_path, output_path, output_prefix, batch_size=GENERATION_BATCH_SIZE,
+                      chunk_size=EVALUATION_CHUNK_SIZE, metric_engine=None, resume=False, context_size=None,
+                      select_context=False):
+    """
+    generates predictions and evaluates them chunk by chunk. The predictions and scores of every chunk are written to a
+    csv as soon as it is done, and the running average scores to the eval results json, so a crashed run can be
+    resumed from its last completed chunk. When all chunks are done the chunks are merged into the predictions csv
+    :param model: the model
+    :param tokenizer: the tokenizer
+    :param test_data_path: path to the test data csv
+    :param output_path: path to output dir
+    :param output_prefix: prefix of the output files
+    :param batch_size: number of examples to generate for at once
+    :param chunk_size: number of examples per chunk
+    :param metric_engine: MetricEngine to score with
+    :param resume: if True continues from the last completed chunk of a previous run
+    :param context_size: if given, article bodies are trimmed and inputs truncated to this number of tokens
+    :param select_context: if True article bodies are reduced to their sentences most relevant to the question
+    :return: average evaluation metrics' scores
+    """
+    metric_engine = metric_engine or MetricEngine()
+    chunks_dir = os.path.join(output_path, f'predictions_{output_prefix}_chunks')
+    os.makedirs(chunks_dir, exist_ok=True)
+    checkpoint = EvaluationCheckpoint(os.path.join(chunks_dir, EVALUATION_CHECKPOINT_NAME), test_data_path,
+                                      chunk_size, resume)
+    test_df = load_test_df(test_data_path, tokenizer, context_size, select_context)
+    num_chunks = (len(test_df) + chunk_size - 1) // chunk_size
+    if checkpoint.num_completed_chunks > 0:
+        print(f"Resuming from chunk {checkpoint.num_completed_chunks}/{num_chunks}")
+    num_generated_examples, num_generated_tokens, generation_time = 0, 0, 0
+    for chunk_idx in range(checkpoint.num_completed_chunks, num_chunks):
+        chunk_df = test_df.iloc[chunk_idx * chunk_size:(chunk_idx + 1) * chunk_size]
+        all_input_ids = tokenizer(chunk_df[MODEL_INPUT_COLUMN_NAME].tolist(), max_length=context_size,
+                                  truncation=context_size is not None)[MODEL_INPUT_IDS]
+        start_time = time.perf_counter()
+        predictions, num_chunk_tokens = generate_in_length_sorted_batches(model, tokenizer, all_input_ids, batch_size)
+        generation_time += time.perf_counter() - start_time
+        num_generated_examples += len(predictions)
+        num_generated_tokens += num_chunk_tokens
+        references = chunk_df[LABEL_COLUMN_NAME]
+        chunk_avg_scores, chunk_all_scores = run_all_eval_metrics(predictions, references, tokenizer, metric_engine)
+        predictions_df = create_predictions_df(predictions, references, chunk_df[ARTICLE_TITLE_COLUMN_NAME],
+                                               chunk_all_scores)
+        chunk_path = os.path.join(chunks_dir, f'chunk_{chunk_idx:05d}.csv')
+        predictions_df.to_csv(f'{chunk_path}.tmp', encoding='utf8')
+        os.replace(f'{chunk_path}.tmp', chunk_path)
+        checkpoint.add_chunk(chunk_avg_scores, len(predictions))
+        eval_results = {**checkpoint.avg_scores, 'num_examples': checkpoint.num_examples,
+                        'complete': chunk_idx == num_chunks - 1}
+        if num_generated_examples > 0:
+            eval_results['generation'] = get_generation_stats(num_generated_examples, num_generated_tokens,
+                                                              generation_time, batch_size, model.device)
+        write_out_eval_results(eval_results, output_path, output_prefix)
+    predictions_path = os.path.join(output_path, f'predictions_{output_prefix}.csv')
+    for chunk_idx, predictions_df in enumerate(iter_predictions_chunks(chunks_dir, num_chunks)):
+        predictions_df.to_csv(predictions_path, mode='w' if chunk_idx == 0 else 'a', header=chunk_idx == 0,
+                              encoding='utf8')
+    write_out_examples_with_lowest_BERTscore_to_csv(iter_predictions_chunks(chunks_dir, num_chunks), output_path,
+                                                    output_prefix)
+    return checkpoint.avg_scores
+
+
+def main(model_path, pretrain_model_name, is_baseline, output_prefix, test_data_path, output_path,
+         batch_size=GENERATION_BATCH_SIZE, device=None, dtype=torch.float32, quantize=False, num_workers=1,
+         score_cache_path=None, stream=False, chunk_size=EVALUATION_CHUNK_SIZE, resume=False, context_size=None,
+         select_context=False):
+    model, tokenizer = load_model_and_tokenizer(model_path, pretrain_model_name, is_baseline, device, dtype, quantize)
+    metric_engine = MetricEngine(num_workers, score_cache_path or os.path.join(output_path, METRIC_SCORES_CACHE_NAME))
+    if stream:
+        stream_evaluation(model, tokenizer, test_data_path, output_path, output_prefix, batch_size, chunk_size,
+                          metric_engine, resume, context_size, select_context)
+        return
+    predictions, references, titles, generation_stats = generate_predictions(model, tokenizer, test_data_path,
+                                                                             batch_size, context_size, select_context)
+    eval_metric_avg_scores, eval_metric_all_scores = run_all_eval_metrics(predictions, references, tokenizer,
+                                                                          metric_engine)
+    write_out_eval_results({**eval_metric_avg_scores, 'generation': generation_stats}, output_path, output_prefix)
     predictions_df = create_predictions_df(predictions, references, titles, eval_metric_all_scores)
     write_out_all_predictions_to_csv(predictions_df, output_path, output_prefix)
     write_out_examples_with_lowest_BERTscore_to_csv(predictions_df, output_path, output_prefix)
@@ -172,4 +372,9 @@ def main(model_path, pretrain_model_name, is_baseline, output_prefix, test_data_
 
 if __name__ == '__main__':
     args = parse_args()
-    main(args.model_path, args.model_name, args.is_baseline, args.output_prefix, args.test_data_path, args.output_path)
+    with profiled(args.profile):
+        main(args.model_path, args.model_name, args.is_baseline, args.output_prefix, args.test_data_path,
+             args.output_path, args.batch_size, args.device, torch.bfloat16 if args.bf16 else torch.float32,
+             args.quantize, args.num_workers, args.score_cache_path, args.stream, args.chunk_size, args.resume,
+             args.context_size, args.select_context)
+    write_report(args.metrics_report)
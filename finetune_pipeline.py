@@ -1,40 +1,113 @@
+import os
+import shutil
+import hashlib
 import transformers
 from datasets import Dataset
 import pandas as pd
-from transformers import TrainingArguments, Trainer
+from transformers import TrainingArguments, Trainer, DataCollatorForSeq2Seq
 import torch
 import argparse
 from utils import merge_article_title_and_body_into_one_for_model_input
+from context_selection import reduce_article_bodies
+from instrumentation import timer, increment, set_gauge, write_report, profiled
 from consts import *
 
 
-def preprocess_function(examples, context_size):
+def preprocess_function(examples, context_size, dynamic_padding=False):
     """
     preprocesses data for training into the input format expected by the model
     :param examples: data examples
     :param context_size: max number of tokens for padding purposes (represents the length of context)
+    :param dynamic_padding: if True inputs are only truncated, and padded later per batch by the data collator
     :return: model inputs
     """
+    padding = False if dynamic_padding else PADDING
     inputs = [ex for ex in examples[MODEL_INPUT_COLUMN_NAME]]
     targets = [ex for ex in examples[LABEL_COLUMN_NAME]]
-    model_inputs = tokenizer(inputs, max_length=context_size, padding=PADDING, truncation=True)
-    labels = tokenizer(targets, max_length=context_size, padding=PADDING, truncation=True)
+    with timer('tokenize'):
+        model_inputs = tokenizer(inputs, max_length=context_size, padding=padding, truncation=True)
+        labels = tokenizer(targets, max_length=context_size, padding=padding, truncation=True)
+    increment('tokenized_examples', len(inputs))
+    increment('tokenized_input_tokens', sum(sum(mask) for mask in model_inputs[MODEL_ATTENTION_MASK]))
 
     model_inputs["labels"] = labels["input_ids"]
+    if dynamic_padding:
+        model_inputs[LENGTH_COLUMN_NAME] = [len(input_ids) for input_ids in model_inputs[MODEL_INPUT_IDS]]
     return model_inputs
 
 
-def load_datasets():
+def hash_file(path):
     """
-    loads train and validation datasets from csv
-    :return: Dataset objects representing training and validation data
+    :param path: path to a file
+    :return: sha256 hex digest of the file content
     """
-    train = pd.read_csv(TRAIN_CSV_PATH)
-    val = pd.read_csv(VALIDATION_CSV_PATH)
+    file_hash = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(2 ** 20), b''):
+            file_hash.update(block)
+    return file_hash.hexdigest()
 
-    data_train = Dataset.from_pandas(merge_article_title_and_body_into_one_for_model_input(train))
-    data_val = Dataset.from_pandas(merge_article_title_and_body_into_one_for_model_input(val))
-    return data_train, data_val
+
+def get_tokenized_dataset_cache_path(cache_dir, tokenizer_name, context_size, data_path, dynamic_padding=False,
+                                     trim_bodies=False, select_context=False):
+    """
+    :param cache_dir: path to the tokenization cache dir
+    :param tokenizer_name: name of the tokenizer (e.g. google/mt5-base)
+    :param context_size: max number of tokens
+    :param data_path: path to the data csv
+    :param dynamic_padding: whether the dataset is tokenized for dynamic padding
+    :param trim_bodies: whether the article bodies are trimmed to the context size
+    :param select_context: whether the article bodies are reduced to their most relevant sentences
+    :return: path of the cached tokenized dataset of the given tokenizer, context size and data file content
+    """
+    padding = 'dynamic' if dynamic_padding else PADDING
+    key = '|'.join([tokenizer_name, str(context_size), padding, MODEL_INPUT_FORMAT, hash_file(data_path)] +
+                   (['trim_bodies'] if trim_bodies else []) + (['select_context'] if select_context else []))
+    return os.path.join(cache_dir, hashlib.sha256(key.encode('utf-8')).hexdigest()[:32])
+
+
+def count_input_tokens(dataset):
+    """
+    :param dataset: tokenized Dataset
+    :return: number of input tokens in the dataset, not counting padding
+    """
+    return sum(sum(mask) for mask in dataset[MODEL_ATTENTION_MASK])
+
+
+def load_tokenized_dataset(data_path, tokenizer_name, context_size, cache_dir, dynamic_padding=False,
+                           trim_bodies=False, select_context=False):
+    """
+    loads the tokenized dataset from the cache, tokenizing and caching it if it is not cached yet. Cached datasets are
+    memory-mapped arrow files, so loading them does not copy the data into memory
+    :param data_path: path to the data csv
+    :param tokenizer_name: name of the tokenizer (e.g. google/mt5-base)
+    :param context_size: max number of tokens
+    :param cache_dir: path to the tokenization cache dir
+    :param dynamic_padding: if True the examples are not padded (see preprocess_function)
+    :param trim_bodies: if True the article bodies are trimmed at word boundaries to fit the context size before
+    tokenization (instead of being cut by the tokenizer truncation)
+    :param select_context: if True the article bodies are reduced to their sentences most relevant to the question
+    which fit the context size (see context_selection.select_relevant_sentences)
+    :return: tokenized Dataset with input_ids, attention_mask and labels
+    """
+    cache_path = get_tokenized_dataset_cache_path(cache_dir, tokenizer_name, context_size, data_path, dynamic_padding,
+                                                  trim_bodies, select_context)
+    if os.path.exists(cache_path):
+        return Dataset.load_from_disk(cache_path)
+    df = pd.read_csv(data_path)
+    if select_context:
+        df = reduce_article_bodies(df, tokenizer, context_size)
+    data = Dataset.from_pandas(merge_article_title_and_body_into_one_for_model_input(
+        df, tokenizer, context_size if trim_bodies else None))
+    tokenized_data = data.map(preprocess_function, batched=True, desc="Running tokenizer",
+                              remove_columns=data.column_names,
+                              fn_kwargs={"context_size": context_size, "dynamic_padding": dynamic_padding})
+    # saved to a temporary dir first, so a run killed while saving does not leave a partial dataset in the cache
+    tmp_path = f'{cache_path}.{os.getpid()}.tmp'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    tokenized_data.save_to_disk(tmp_path)
+    os.replace(tmp_path, cache_path)
+    return Dataset.load_from_disk(cache_path)
 
 
 def parse_args():
@@ -43,33 +116,60 @@ def parse_args():
     parser.add_argument('--context_size', '-c', type=int, help='size of context')
     parser.add_argument('--batch_size', '-b', type=int, help='size of batch')
     parser.add_argument('--num_epochs', '-e', type=int, help='num epochs')
+    parser.add_argument('--cache_dir', type=str, help='path to the tokenized datasets cache dir',
+                        default=TOKENIZATION_CACHE_DIR)
+    parser.add_argument('--dynamic_padding', action='store_true', default=False,
+                        help='pad per batch instead of to context size, batching examples of similar length together')
+    parser.add_argument('--trim_bodies', action='store_true', default=False,
+                        help='trim article bodies at word boundaries to fit the context size')
+    parser.add_argument('--select_context', action='store_true', default=False,
+                        help='reduce article bodies to their sentences most relevant to the question (needs -c)')
+    parser.add_argument('--metrics_report', type=str,
+                        help='path to write the run metrics to (Prometheus text format if it ends with .prom, else json)')
+    parser.add_argument('--profile', type=str, help='path to write a cProfile dump of the training to')
     args = parser.parse_args()
+    if args.select_context and args.context_size is None:
+        parser.error('--select_context needs --context_size')
     return args
 
 
 if __name__ == '__main__':
     args = parse_args()
 
-    data_train, data_val = load_datasets()
     model = transformers.MT5ForConditionalGeneration.from_pretrained(MT5_MODELS_DICT[args.model_name])
     tokenizer = transformers.MT5Tokenizer.from_pretrained(MT5_MODELS_DICT[args.model_name])
 
-    train_dataset = data_train.map(preprocess_function, batched=True, desc="Running tokenizer",
-                                   fn_kwargs={"context_size": args.context_size})
-    val_dataset = data_val.map(preprocess_function, batched=True, desc="Running tokenizer",
-                               fn_kwargs={"context_size": args.context_size})
+    with timer('load_tokenized_dataset', split='train'):
+        train_dataset = load_tokenized_dataset(TRAIN_CSV_PATH, MT5_MODELS_DICT[args.model_name], args.context_size,
+                                               args.cache_dir, args.dynamic_padding, args.trim_bodies,
+                                               args.select_context)
+    with timer('load_tokenized_dataset', split='validation'):
+        val_dataset = load_tokenized_dataset(VALIDATION_CSV_PATH, MT5_MODELS_DICT[args.model_name],
+                                             args.context_size, args.cache_dir, args.dynamic_padding,
+                                             args.trim_bodies, args.select_context)
+    # with dynamic padding, labels are padded with -100 so the loss ignores the padding
+    data_collator = DataCollatorForSeq2Seq(tokenizer, model=model, label_pad_token_id=LABEL_PAD_TOKEN_ID) \
+        if args.dynamic_padding else None
 
     training_args = TrainingArguments(output_dir='.',
                                       evaluation_strategy="epoch",
                                       save_strategy="no",
                                       num_train_epochs=args.num_epochs,
-                                      per_device_train_batch_size=args.batch_size)
+                                      per_device_train_batch_size=args.batch_size,
+                                      group_by_length=args.dynamic_padding,
+                                      length_column_name=LENGTH_COLUMN_NAME)
 
     trainer = Trainer(model=model,
                       args=training_args,
                       train_dataset=train_dataset,
                       eval_dataset=val_dataset,
-                      tokenizer=tokenizer)
-    trainer.train()
+                      tokenizer=tokenizer,
+                      data_collator=data_collator)
+    with profiled(args.profile), timer('train'):
+        train_output = trainer.train()
+    set_gauge('train_input_tokens_per_sec',
+              count_input_tokens(train_dataset) * args.num_epochs / train_output.metrics['train_runtime'])
+    set_gauge('train_samples_per_sec', train_output.metrics['train_samples_per_second'])
     torch.save(model.state_dict(),
                f'finetuned_MT5_context_{args.context_size}_batch_size_{args.batch_size}_epochs_{args.num_epochs}.pt')
+    write_report(args.metrics_report)
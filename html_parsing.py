@@ -0,0 +1,103 @@
+from bs4 import BeautifulSoup
+from bs4.dammit import UnicodeDammit
+
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:
+    LexborHTMLParser = None
+
+try:
+    import lxml.html
+    import cssselect
+except ImportError:
+    lxml = None
+
+
+def decode_html(content):
+    """
+    decodes raw HTML, trying utf-8 first (used by all supported sites) before guessing the encoding
+    :param content: raw HTML bytes (or an already decoded string)
+    :return: HTML string
+    """
+    if isinstance(content, str):
+        return content
+    try:
+        return content.decode('utf-8')
+    except UnicodeDecodeError:
+        return UnicodeDammit(content).unicode_markup
+
+
+class Bs4Page:
+    """
+    HTML page parsed with BeautifulSoup (html.parser), the slowest but most lenient backend
+    """
+
+    def __init__(self, content):
+        self.__soup = BeautifulSoup(content, 'html.parser')
+
+    def select(self, css):
+        return self.__soup.select(css)
+
+    def select_one(self, css):
+        return self.__soup.select_one(css)
+
+    @staticmethod
+    def text(node):
+        return node.get_text()
+
+
+class LxmlPage:
+    """
+    HTML page parsed with lxml, queried with CSS selectors through cssselect
+    """
+
+    def __init__(self, content):
+        self.__root = lxml.html.fromstring(decode_html(content))
+
+    def select(self, css):
+        return self.__root.cssselect(css)
+
+    def select_one(self, css):
+        nodes = self.__root.cssselect(css)
+        return nodes[0] if len(nodes) > 0 else None
+
+    @staticmethod
+    def text(node):
+        return node.text_content()
+
+
+class SelectolaxPage:
+    """
+    HTML page parsed with selectolax (lexbor engine), the fastest backend
+    """
+
+    def __init__(self, content):
+        self.__tree = LexborHTMLParser(decode_html(content))
+
+    def select(self, css):
+        return self.__tree.css(css)
+
+    def select_one(self, css):
+        return self.__tree.css_first(css)
+
+    @staticmethod
+    def text(node):
+        return node.text()
+
+
+PARSER_BACKENDS = {'bs4': Bs4Page}
+if lxml is not None:
+    PARSER_BACKENDS['lxml'] = LxmlPage
+if LexborHTMLParser is not None:
+    PARSER_BACKENDS['selectolax'] = SelectolaxPage
+DEFAULT_PARSER_BACKEND = next(backend for backend in ['selectolax', 'lxml', 'bs4'] if backend in PARSER_BACKENDS)
+
+
+def parse_html(content, backend=DEFAULT_PARSER_BACKEND):
+    """
+    parses raw HTML with the given backend
+    :param content: raw HTML
+    :param backend: name of the parsing backend (one of PARSER_BACKENDS)
+    :return: parsed page, supporting select, select_one and text
+    """
+    return PARSER_BACKENDS[backend](content)
@@ -0,0 +1,299 @@
+import argparse
+import json
+import time
+import queue
+import threading
+import numpy as np
+import torch
+from collections import deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from utils import load_model_and_tokenizer, generate_batch, trim_article_bodies_to_token_budget
+from consts import *
+
+
+class ServerOverloadedError(Exception):
+    """
+    Raised when the request queue is full
+    """
+    pass
+
+
+class PendingRequest:
+    """
+    A request waiting in the queue for its micro-batch to be generated
+    """
+
+    def __init__(self, input_ids, deadline):
+        """
+        :param input_ids: tokenized model input
+        :param deadline: time (time.perf_counter) after which the request is no longer answered
+        """
+        self.input_ids = input_ids
+        self.deadline = deadline
+        self.arrival_time = time.perf_counter()
+        self.prediction = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class LatencyStats:
+    """
+    Latencies and completion times of the most recent requests, for the latency percentiles and throughput metrics
+    """
+
+    def __init__(self, window_size=SERVER_LATENCY_WINDOW_SIZE):
+        """
+        :param window_size: number of most recent requests to keep
+        """
+        self.__latencies = deque(maxlen=window_size)
+        self.__completion_times = deque(maxlen=window_size)
+        self.__lock = threading.Lock()
+
+    def record(self, latency):
+        """
+        :param latency: latency of a completed request (in seconds)
+        """
+        with self.__lock:
+            self.__latencies.append(latency)
+            self.__completion_times.append(time.perf_counter())
+
+    def summary(self):
+        """
+        :return: dictionary of p50/p95 latency (in ms) and throughput (requests per second) of the recent requests
+        """
+        with self.__lock:
+            latencies = list(self.__latencies)
+            completion_times = list(self.__completion_times)
+        if len(latencies) == 0:
+            return {'p50_latency_ms': None, 'p95_latency_ms': None, 'requests_per_sec': None}
+        p50, p95 = np.percentile(latencies, [50, 95]) * 1000
+        window_time = time.perf_counter() - completion_times[0]
+        return {'p50_latency_ms': p50, 'p95_latency_ms': p95,
+                'requests_per_sec': len(completion_times) / window_time if window_time > 0 else None}
+
+
+class MicroBatcher:
+    """
+    Answers concurrent requests with a single model, generating for up to max_batch_size queued requests at once.
+    A batch is generated as soon as it is full or max_batch_delay seconds after its first request arrived. Requests
+    whose deadline passed before generation are dropped, and new requests are rejected while the queue is full
+    """
+
+    def __init__(self, model, tokenizer, max_batch_size=SERVER_MAX_BATCH_SIZE, max_batch_delay=SERVER_MAX_BATCH_DELAY,
+                 max_queue_size=SERVER_MAX_QUEUE_SIZE):
+        """
+        :param model: the model
+        :param tokenizer: the tokenizer
+        :param max_batch_size: max number of requests generated for at once
+        :param max_batch_delay: max number of seconds to wait for more requests before generating a batch
+        :param max_queue_size: max number of queued requests (further requests are rejected)
+        """
+        self.__model = model
+        self.__tokenizer = tokenizer
+        self.max_batch_size = max_batch_size
+        self.max_batch_delay = max_batch_delay
+        self.__queue = queue.Queue(maxsize=max_queue_size)
+        self.__latency_stats = LatencyStats()
+        self.__counts = {'completed': 0, 'rejected': 0, 'timed_out': 0, 'batches': 0, 'generated_tokens': 0}
+        self.__counts_lock = threading.Lock()
+        self.__start_time = time.perf_counter()
+        self.__thread = threading.Thread(target=self.__run, daemon=True)
+        self.__thread.start()
+
+    def __count(self, name, value=1):
+        with self.__counts_lock:
+            self.__counts[name] += value
+
+    def submit(self, input_ids, timeout=SERVER_REQUEST_TIMEOUT):
+        """
+        queues a request and waits for its prediction
+        :param input_ids: tokenized model input
+        :param timeout: max number of seconds to wait for the prediction
+        :return: the prediction
+        :raises ServerOverloadedError: if the queue is full
+        :raises TimeoutError: if the prediction was not generated before the deadline
+        :raises RuntimeError: if the generation failed
+        """
+        request = PendingRequest(input_ids, time.perf_counter() + timeout)
+        try:
+            self.__queue.put_nowait(request)
+        except queue.Full:
+            self.__count('rejected')
+            raise ServerOverloadedError(f"More than {self.__queue.maxsize} requests are queued")
+        if not request.done.wait(timeout) or isinstance(request.error, TimeoutError):
+            self.__count('timed_out')
+            raise TimeoutError(f"No prediction within {timeout}s")
+        if request.error is not None:
+            raise request.error
+        self.__latency_stats.record(time.perf_counter() - request.arrival_time)
+        self.__count('completed')
+        return request.prediction
+
+    def __collect_batch(self):
+        """
+        :return: list of requests to generate for (waits for the first one)
+        """
+        batch = [self.__queue.get()]
+        batch_deadline = min(time.perf_counter() + self.max_batch_delay, batch[0].deadline)
+        while len(batch) < self.max_batch_size:
+            remaining_time = batch_deadline - time.perf_counter()
+            if remaining_time <= 0:
+                break
+            try:
+                batch.append(self.__queue.get(timeout=remaining_time))
+            except queue.Empty:
+                break
+        return batch
+
+    def __run(self):
+        while True:
+            batch = self.__collect_batch()
+            now = time.perf_counter()
+            expired_requests = [request for request in batch if request.deadline <= now]
+            batch = [request for request in batch if request.deadline > now]
+            for request in expired_requests:
+                request.error = TimeoutError()
+                request.done.set()
+            if len(batch) == 0:
+                continue
+            try:
+                predictions, num_generated_tokens = generate_batch(self.__model, self.__tokenizer,
+                                                                   [request.input_ids for request in batch])
+            except Exception as e:
+                print(f"Generation failed: {e}")
+                predictions, num_generated_tokens = [None] * len(batch), 0
+            self.__count('batches')
+            self.__count('generated_tokens', num_generated_tokens)
+            for request, prediction in zip(batch, predictions):
+                request.prediction = prediction
+                request.error = RuntimeError("Generation failed") if prediction is None else None
+                request.done.set()
+
+    def metrics(self):
+        """
+        :return: dictionary of the server metrics (latency percentiles, throughput, queue size and request counts)
+        """
+        with self.__counts_lock:
+            counts = dict(self.__counts)
+        uptime = time.perf_counter() - self.__start_time
+        return {**self.__latency_stats.summary(), **counts,
+                'avg_batch_size': counts['completed'] / counts['batches'] if counts['batches'] > 0 else None,
+                'tokens_per_sec': counts['generated_tokens'] / uptime,
+                'queue_size': self.__queue.qsize(), 'uptime_sec': uptime}
+
+
+class InferenceRequestHandler(BaseHTTPRequestHandler):
+    """
+    POST /predict with a json body {"title": article title, "body": article body} answers with {"prediction": ...}.
+    GET /metrics answers with the server metrics
+    """
+
+    def __send_json(self, status, content, headers=None):
+        body = json.dumps(content, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            self.__send_json(200, self.server.batcher.metrics())
+        elif self.path == '/health':
+            self.__send_json(200, {'status': 'ok'})
+        else:
+            self.__send_json(404, {'error': f"Unknown path {self.path}"})
+
+    def do_POST(self):
+        if self.path != '/predict':
+            self.__send_json(404, {'error': f"Unknown path {self.path}"})
+            return
+        try:
+            example = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            title, body = example['title'], example['body']
+        except (ValueError, KeyError, TypeError) as e:
+            self.__send_json(400, {'error': f"Expected a json object with title and body: {e}"})
+            return
+        if self.server.context_size is not None:
+            body = trim_article_bodies_to_token_budget([title], [body], self.server.tokenizer,
+                                                       self.server.context_size)[0]
+        model_input = MODEL_INPUT_FORMAT.format(title, body)
+        input_ids = self.server.tokenizer(model_input, max_length=self.server.context_size,
+                                          truncation=self.server.context_size is not None)[MODEL_INPUT_IDS]
+        try:
+            prediction = self.server.batcher.submit(input_ids, self.server.request_timeout)
+        except ServerOverloadedError as e:
+            self.__send_json(503, {'error': str(e)}, {'Retry-After': '1'})
+        except TimeoutError as e:
+            self.__send_json(504, {'error': str(e)})
+        except RuntimeError as e:
+            self.__send_json(500, {'error': str(e)})
+        else:
+            self.__send_json(200, {'prediction': prediction})
+
+    def log_message(self, format, *args):
+        pass
+
+
+def create_server(model, tokenizer, host=SERVER_HOST, port=SERVER_PORT, context_size=None,
+                  request_timeout=SERVER_REQUEST_TIMEOUT, **batcher_kwargs):
+    """
+    creates the inference HTTP server (call serve_forever to start serving)
+    :param model: the model
+    :param tokenizer: the tokenizer
+    :param host: host to listen on
+    :param port: port to listen on (0 for any free port)
+    :param context_size: max number of input tokens (article bodies are trimmed to fit), None for no limit
+    :param request_timeout: max number of seconds to answer a request
+    :param batcher_kwargs: keyword arguments of MicroBatcher (max_batch_size, max_batch_delay, max_queue_size)
+    :return: the server
+    """
+    server = ThreadingHTTPServer((host, port), InferenceRequestHandler)
+    server.daemon_threads = True
+    server.tokenizer = tokenizer
+    server.context_size = context_size
+    server.request_timeout = request_timeout
+    server.batcher = MicroBatcher(model, tokenizer, **batcher_kwargs)
+    return server
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model_path', '-m', type=str, help='path to the model state dict')
+    parser.add_argument('--model_name', '-n', type=str, help='name of pretrained model')
+    parser.add_argument('--is_baseline', action="store_true")
+    parser.add_argument('--host', type=str, help='host to listen on', default=SERVER_HOST)
+    parser.add_argument('--port', type=int, help='port to listen on', default=SERVER_PORT)
+    parser.add_argument('--context_size', '-c', type=int,
+                        help='max number of input tokens (trims longer article bodies)')
+    parser.add_argument('--max_batch_size', type=int, help='max number of requests per batch',
+                        default=SERVER_MAX_BATCH_SIZE)
+    parser.add_argument('--max_batch_delay', type=float, help='max seconds to wait for a batch to fill',
+                        default=SERVER_MAX_BATCH_DELAY)
+    parser.add_argument('--max_queue_size', type=int, help='max number of queued requests (more are rejected)',
+                        default=SERVER_MAX_QUEUE_SIZE)
+    parser.add_argument('--request_timeout', type=float, help='max seconds to answer a request',
+                        default=SERVER_REQUEST_TIMEOUT)
+    parser.add_argument('--device', type=str, help='device to run the model on (default: GPU if available)')
+    parser.add_argument('--bf16', action="store_true", help='load the model weights in bfloat16')
+    parser.add_argument('--quantize', action="store_true", help='dynamic int8 quantization (CPU only)')
+    args = parser.parse_args()
+    if args.bf16 and args.quantize:
+        parser.error('--bf16 and --quantize can not be used together (quantized models run in float32)')
+    return args
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    model, tokenizer = load_model_and_tokenizer(args.model_path, args.model_name, args.is_baseline, args.device,
+                                                torch.bfloat16 if args.bf16 else torch.float32, args.quantize)
+    server = create_server(model, tokenizer, args.host, args.port, args.context_size, args.request_timeout,
+                           max_batch_size=args.max_batch_size, max_batch_delay=args.max_batch_delay,
+                           max_queue_size=args.max_queue_size)
+    print(f"Serving on http://{args.host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
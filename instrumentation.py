@@ -0,0 +1,240 @@
+import io
+import sys
+import json
+import time
+import pstats
+import cProfile
+import threading
+from contextlib import contextmanager
+from consts import *
+
+
+class MetricsRegistry:
+    """
+    Thread safe registry of the pipeline metrics: stage timers, counters, histograms and gauges, each identified by a
+    name and optional labels (e.g. domain or filter name)
+    """
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__timers = {}
+        self.__counters = {}
+        self.__histograms = {}
+        self.__gauges = {}
+
+    @staticmethod
+    def __key(name, labels):
+        return name, tuple(sorted((label, str(value)) for label, value in labels.items()))
+
+    def record_time(self, name, seconds, **labels):
+        """
+        adds a measured duration to a stage timer
+        :param name: name of the stage
+        :param seconds: duration
+        :param labels: labels of the timer
+        """
+        with self.__lock:
+            timer = self.__timers.setdefault(self.__key(name, labels), {'count': 0, 'total_sec': 0, 'max_sec': 0})
+            timer['count'] += 1
+            timer['total_sec'] += seconds
+            timer['max_sec'] = max(timer['max_sec'], seconds)
+
+    def increment(self, name, value=1, **labels):
+        """
+        increments a counter
+        :param name: name of the counter
+        :param value: amount to increment by
+        :param labels: labels of the counter
+        """
+        key = self.__key(name, labels)
+        with self.__lock:
+            self.__counters[key] = self.__counters.get(key, 0) + value
+
+    def observe(self, name, value, buckets=LATENCY_HISTOGRAM_BUCKETS, **labels):
+        """
+        adds an observation to a histogram
+        :param name: name of the histogram
+        :param value: observed value
+        :param buckets: upper bounds of the histogram buckets (used when the histogram is created)
+        :param labels: labels of the histogram
+        """
+        with self.__lock:
+            histogram = self.__histograms.setdefault(self.__key(name, labels), {
+                'buckets': {upper_bound: 0 for upper_bound in buckets}, 'count': 0, 'sum': 0})
+            for upper_bound in histogram['buckets']:
+                if value <= upper_bound:
+                    histogram['buckets'][upper_bound] += 1
+            histogram['count'] += 1
+            histogram['sum'] += value
+
+    def set_gauge(self, name, value, **labels):
+        """
+        sets a gauge (e.g. tokens per second of a run)
+        :param name: name of the gauge
+        :param value: value
+        :param labels: labels of the gauge
+        """
+        with self.__lock:
+            self.__gauges[self.__key(name, labels)] = value
+
+    def report(self):
+        """
+        :return: dictionary of all the metrics, json serializable (histogram buckets are cumulative)
+        """
+        with self.__lock:
+            return {'timers': [{'name': name, 'labels': dict(labels), **timer}
+                               for (name, labels), timer in self.__timers.items()],
+                    'counters': [{'name': name, 'labels': dict(labels), 'value': value}
+                                 for (name, labels), value in self.__counters.items()],
+                    'histograms': [{'name': name, 'labels': dict(labels),
+                                    'buckets': {str(upper_bound): count
+                                                for upper_bound, count in histogram['buckets'].items()},
+                                    'count': histogram['count'], 'sum': histogram['sum']}
+                                   for (name, labels), histogram in self.__histograms.items()],
+                    'gauges': [{'name': name, 'labels': dict(labels), 'value': value}
+                               for (name, labels), value in self.__gauges.items()]}
+
+    def to_prometheus(self):
+        """
+        :return: all the metrics in the Prometheus text exposition format
+        """
+        def format_labels(labels, **extra_labels):
+            labels = {**labels, **extra_labels}
+            if len(labels) == 0:
+                return ''
+            return '{' + ','.join(f'{label}="{value}"' for label, value in labels.items()) + '}'
+
+        report = self.report()
+        lines = []
+        for timer in report['timers']:
+            name = f"{METRICS_PREFIX}_{timer['name']}_seconds"
+            lines.append(f"{name}_sum{format_labels(timer['labels'])} {timer['total_sec']}")
+            lines.append(f"{name}_count{format_labels(timer['labels'])} {timer['count']}")
+        for counter in report['counters']:
+            name = f"{METRICS_PREFIX}_{counter['name']}_total"
+            lines.append(f"{name}{format_labels(counter['labels'])} {counter['value']}")
+        for histogram in report['histograms']:
+            name = f"{METRICS_PREFIX}_{histogram['name']}"
+            for upper_bound, count in histogram['buckets'].items():
+                lines.append(f"{name}_bucket{format_labels(histogram['labels'], le=upper_bound)} {count}")
+            lines.append(f"{name}_bucket{format_labels(histogram['labels'], le='+Inf')} {histogram['count']}")
+            lines.append(f"{name}_sum{format_labels(histogram['labels'])} {histogram['sum']}")
+            lines.append(f"{name}_count{format_labels(histogram['labels'])} {histogram['count']}")
+        for gauge in report['gauges']:
+            lines.append(f"{METRICS_PREFIX}_{gauge['name']}{format_labels(gauge['labels'])} {gauge['value']}")
+        return '\n'.join(lines) + '\n'
+
+    def write_report(self, path):
+        """
+        writes all the metrics to a file, in the Prometheus text format if the path ends with .prom, else as json
+        :param path: path to the report file
+        """
+        with open(path, 'w') as f:
+            if path.endswith('.prom'):
+                f.write(self.to_prometheus())
+            else:
+                json.dump(self.report(), f, indent=2)
+
+
+registry = MetricsRegistry()
+
+
+@contextmanager
+def timer(name, **labels):
+    """
+    times the enclosed block (or the decorated function) into a stage timer of the registry
+    :param name: name of the stage
+    :param labels: labels of the timer
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        registry.record_time(name, time.perf_counter() - start, **labels)
+
+
+def increment(name, value=1, **labels):
+    """
+    increments a counter of the registry (see MetricsRegistry.increment)
+    """
+    registry.increment(name, value, **labels)
+
+
+def observe(name, value, **labels):
+    """
+    adds an observation to a histogram of the registry (see MetricsRegistry.observe)
+    """
+    registry.observe(name, value, **labels)
+
+
+def set_gauge(name, value, **labels):
+    """
+    sets a gauge of the registry (see MetricsRegistry.set_gauge)
+    """
+    registry.set_gauge(name, value, **labels)
+
+
+def write_report(path):
+    """
+    writes the registry report (see MetricsRegistry.write_report), if a path is given
+    :param path: path to the report file, or None
+    """
+    if path is not None:
+        registry.write_report(path)
+        print(f"Wrote metrics report to {path}")
+
+
+# on Python 3.12+ cProfile is built on sys.monitoring, which allows a single active profiler in the process, but that
+# profiler sees the calls of every thread
+SINGLE_PROFILER = sys.version_info >= (3, 12)
+profile_lock = threading.Lock()
+
+
+@contextmanager
+def profiled(output_path=None, num_functions=PROFILE_NUM_FUNCTIONS):
+    """
+    profiles the enclosed block with cProfile (including the threads started in it), writing the stats to a file
+    (viewable with pstats or snakeviz) and printing the hot path. Does nothing if no output path is given. Only one
+    block can be profiled at a time, and on Python 3.12+ all threads share one profiler, so the calls of threads which
+    were already running are profiled too (before 3.12 every thread started in the block gets its own profiler)
+    :param output_path: path to the profile stats file, or None
+    :param num_functions: number of functions (by cumulative time) to print
+    :raises RuntimeError: if another block is being profiled
+    """
+    if output_path is None:
+        yield
+        return
+    if not profile_lock.acquire(blocking=False):
+        raise RuntimeError("Another block is already being profiled")
+    profiles = [cProfile.Profile()]
+    profiles_lock = threading.Lock()
+
+    def profile_thread(frame, event, arg):
+        # called on the first event of every new thread, replaces itself with the thread's own profiler
+        thread_profile = cProfile.Profile()
+        with profiles_lock:
+            profiles.append(thread_profile)
+        thread_profile.enable()
+
+    try:
+        if not SINGLE_PROFILER:
+            threading.setprofile(profile_thread)
+        profiles[0].enable()
+        try:
+            yield
+        finally:
+            profiles[0].disable()
+            if not SINGLE_PROFILER:
+                threading.setprofile(None)
+            with profiles_lock:
+                stats = pstats.Stats(profiles[0], stream=io.StringIO())
+                for thread_profile in profiles[1:]:
+                    stats.add(thread_profile)
+            stats.dump_stats(output_path)
+            hot_path = io.StringIO()
+            stats.stream = hot_path
+            stats.sort_stats('cumulative').print_stats(num_functions)
+            print(hot_path.getvalue())
+            print(f"Wrote profile to {output_path}")
+    finally:
+        profile_lock.release()
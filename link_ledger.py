@@ -0,0 +1,54 @@
+import os
+import json
+import threading
+from datetime import datetime
+from consts import *
+
+
+class LinkLedger:
+    """
+    Append-only JSONL ledger of the scraping status of every link (done, failed with the reason, or skipped),
+    used to resume a scraping run without repeating the completed links
+    """
+
+    def __init__(self, path, resume=False):
+        """
+        :param path: path to the ledger file
+        :param resume: if True keeps the records of previous runs, else starts a new ledger
+        """
+        self.path = path
+        self.__statuses = {}
+        self.__lock = threading.Lock()
+        if resume and os.path.exists(path):
+            with open(path, 'r', encoding='utf8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # a partially written last line of a crashed run
+                        continue
+                    self.__statuses[record['link']] = record['status']
+        self.__file = open(path, 'a' if resume else 'w', encoding='utf8')
+
+    def record(self, link, status, reason=None):
+        """
+        appends the status of a link to the ledger
+        :param link: the link
+        :param status: one of LINK_STATUS_DONE, LINK_STATUS_FAILED, LINK_STATUS_SKIPPED
+        :param reason: the failure/skip reason
+        """
+        record = {'link': link, 'status': status, 'reason': reason, 'time': datetime.now().isoformat()}
+        with self.__lock:
+            self.__statuses[link] = status
+            self.__file.write(json.dumps(record, ensure_ascii=False) + '\n')
+            self.__file.flush()
+
+    def is_completed(self, link):
+        """
+        :param link: the link
+        :return: True if the link was already scraped or skipped (failed links are retried)
+        """
+        return self.__statuses.get(link) in (LINK_STATUS_DONE, LINK_STATUS_SKIPPED)
+
+    def close(self):
+        self.__file.close()
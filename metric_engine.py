@@ -0,0 +1,228 @@
+import os
+import json
+import hashlib
+import numpy as np
+from multiprocessing import Pool
+from nltk.translate.bleu_score import sentence_bleu
+from evaluate import load
+from rouge import Rouge
+from consts import *
+
+bertscore_metric = None
+
+
+def calc_bleu_scores(pairs):
+    """
+    calculates the BLEU score of each prediction (based on unigram only because of short labels)
+    :param pairs: list of (prediction, reference) pairs
+    :return: list of BLEU scores
+    """
+    return [sentence_bleu([r.split()], p.split(), weights=(1, 0, 0, 0)) for p, r in pairs]
+
+
+def calc_rouge_scores(pairs):
+    """
+    calculates the ROUGE scores (rouge-1, rouge-2, rouge-l) of each prediction (p, r, f)
+    :param pairs: list of (prediction, reference) pairs
+    :return: list of ROUGE scores dictionaries
+    """
+    hyps, refs = map(list, zip(*pairs))
+    return Rouge().get_scores(hyps, refs, avg=False)
+
+
+def get_bertscore_metric():
+    """
+    :return: the BERTscore metric, loaded once per process (the metric keeps its scoring model between calls)
+    """
+    global bertscore_metric
+    if bertscore_metric is None:
+        bertscore_metric = load("bertscore")
+    return bertscore_metric
+
+
+def calc_bertscores(pairs, batch_size=BERTSCORE_BATCH_SIZE):
+    """
+    calculates the BERTscore of each prediction (p, r, f1)
+    :param pairs: list of (prediction, reference) pairs
+    :param batch_size: number of pairs scored at once
+    :return: list of BERTscores dictionaries
+    """
+    predictions, references = map(list, zip(*pairs))
+    scores = get_bertscore_metric().compute(predictions=predictions, references=references, lang="he",
+                                            batch_size=batch_size)
+    return [{'precision': p, 'recall': r, 'f1': f1}
+            for p, r, f1 in zip(scores['precision'], scores['recall'], scores['f1'])]
+
+
+# metrics which are computed in a process pool
+PROCESS_POOL_METRICS = {'bleu': calc_bleu_scores,
+                        'rouge': calc_rouge_scores}
+
+
+def calc_metric_scores(metric_name, pairs):
+    """
+    :param metric_name: name of a metric in PROCESS_POOL_METRICS
+    :param pairs: list of (prediction, reference) pairs
+    :return: list of the metric's scores of the pairs
+    """
+    return PROCESS_POOL_METRICS[metric_name](pairs)
+
+
+def average_bleu_scores(scores):
+    """
+    :param scores: list of BLEU scores
+    :return: average BLEU score
+    """
+    return np.mean(scores)
+
+
+def average_rouge_scores(scores):
+    """
+    :param scores: list of ROUGE scores dictionaries
+    :return: average ROUGE scores dictionary (as computed by Rouge.get_scores with avg=True)
+    """
+    return {metric: {stat: sum(score[metric][stat] for score in scores) / len(scores) for stat in scores[0][metric]}
+            for metric in scores[0]}
+
+
+def average_bertscores(scores):
+    """
+    :param scores: list of BERTscores dictionaries
+    :return: average BERTscore dictionary (f1, p, r)
+    """
+    return {'f1': np.mean([score['f1'] for score in scores]), 'p': np.mean([score['precision'] for score in scores]),
+            'r': np.mean([score['recall'] for score in scores])}
+
+
+class ScoreCache:
+    """
+    Persistent cache of per-example metric scores, keyed by the hash of the (prediction, reference) pair. The cache file
+    is an append-only JSONL file, so saving only writes the scores added since the last save
+    """
+
+    def __init__(self, cache_path=None):
+        """
+        :param cache_path: path to the cache jsonl file (if None the cache is kept in memory only)
+        """
+        self.cache_path = cache_path
+        self.__scores = {}
+        self.__unsaved_records = []
+        self.__has_partial_line = False
+        if cache_path is not None and os.path.exists(cache_path):
+            with open(cache_path, 'r', encoding='utf8') as f:
+                for line in f:
+                    try:
+                        metric_name, key, score = json.loads(line)
+                    except ValueError:
+                        # a partially written last line of a crashed run
+                        self.__has_partial_line = not line.endswith('\n')
+                        continue
+                    self.__scores.setdefault(metric_name, {})[key] = score
+
+    @staticmethod
+    def key(prediction, reference):
+        """
+        :return: hash of the (prediction, reference) pair
+        """
+        return hashlib.sha1(json.dumps([prediction, reference], ensure_ascii=False).encode('utf-8')).hexdigest()
+
+    def get(self, metric_name, key):
+        """
+        :return: cached score of the metric for the pair with the given key, or None if it was not scored
+        """
+        return self.__scores.get(metric_name, {}).get(key)
+
+    def set(self, metric_name, key, score):
+        self.__scores.setdefault(metric_name, {})[key] = score
+        self.__unsaved_records.append((metric_name, key, score))
+
+    def save(self):
+        """
+        appends the scores added since the last save to the cache file
+        """
+        if self.cache_path is None or len(self.__unsaved_records) == 0:
+            return
+        os.makedirs(os.path.dirname(self.cache_path) or '.', exist_ok=True)
+        with open(self.cache_path, 'a', encoding='utf8') as f:
+            if self.__has_partial_line:
+                f.write('\n')
+                self.__has_partial_line = False
+            f.writelines(json.dumps(record, ensure_ascii=False) + '\n' for record in self.__unsaved_records)
+        self.__unsaved_records = []
+
+
+class MetricEngine:
+    """
+    Computes the per-example scores of all evaluation metrics once (averages are derived from them). Pairs which were
+    already scored are taken from the score cache, BLEU and ROUGE of the rest are computed in a process pool while
+    BERTscore is computed in batches in the current process
+    """
+
+    def __init__(self, num_workers=1, cache_path=None, chunk_size=METRIC_CHUNK_SIZE,
+                 bertscore_batch_size=BERTSCORE_BATCH_SIZE):
+        """
+        :param num_workers: number of processes for BLEU and ROUGE (1 computes them in the current process)
+        :param cache_path: path to the score cache jsonl file (if None scores are cached in memory only)
+        :param chunk_size: number of pairs per process pool task
+        :param bertscore_batch_size: number of pairs scored at once by BERTscore
+        """
+        self.num_workers = num_workers
+        self.chunk_size = chunk_size
+        self.bertscore_batch_size = bertscore_batch_size
+        self.cache = ScoreCache(cache_path)
+
+    def __uncached_pairs(self, metric_name, pairs, keys):
+        """
+        :return: dictionary of key to pair of the distinct pairs without a cached score of the metric
+        """
+        return {key: pair for key, pair in zip(keys, pairs) if self.cache.get(metric_name, key) is None}
+
+    def score(self, predictions, references):
+        """
+        computes the per-example scores of all metrics, and their averages
+        :param predictions: the predictions
+        :param references: the references/labels
+        :return: average evaluation metrics' scores and individual scores for each example (in the format of
+        run_all_eval_metrics)
+        """
+        pairs = list(zip(predictions, references))
+        keys = [ScoreCache.key(prediction, reference) for prediction, reference in pairs]
+        pool = Pool(self.num_workers) if self.num_workers > 1 else None
+        try:
+            pending_results = []
+            for metric_name in PROCESS_POOL_METRICS:
+                uncached_pairs = self.__uncached_pairs(metric_name, pairs, keys)
+                uncached_keys = list(uncached_pairs)
+                for i in range(0, len(uncached_keys), self.chunk_size):
+                    chunk_keys = uncached_keys[i:i + self.chunk_size]
+                    chunk_pairs = [uncached_pairs[key] for key in chunk_keys]
+                    if pool is None:
+                        result = calc_metric_scores(metric_name, chunk_pairs)
+                    else:
+                        result = pool.apply_async(calc_metric_scores, (metric_name, chunk_pairs))
+                    pending_results.append((metric_name, chunk_keys, result))
+            # BERTscore runs here while the pool computes BLEU and ROUGE
+            uncached_pairs = self.__uncached_pairs('BERTscore', pairs, keys)
+            if len(uncached_pairs) > 0:
+                for key, score in zip(uncached_pairs, calc_bertscores(list(uncached_pairs.values()),
+                                                                      self.bertscore_batch_size)):
+                    self.cache.set('BERTscore', key, score)
+            for metric_name, chunk_keys, result in pending_results:
+                for key, score in zip(chunk_keys, result if pool is None else result.get()):
+                    self.cache.set(metric_name, key, score)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        self.cache.save()
+        bleu_scores = [self.cache.get('bleu', key) for key in keys]
+        rouge_scores = [self.cache.get('rouge', key) for key in keys]
+        bertscores = [self.cache.get('BERTscore', key) for key in keys]
+        eval_metric_avg_scores = {'bleu': average_bleu_scores(bleu_scores),
+                                  'rouge': average_rouge_scores(rouge_scores),
+                                  'BERTscore': average_bertscores(bertscores)}
+        eval_metric_all_scores = {'bleu': bleu_scores,
+                                  'rouge': rouge_scores,
+                                  'BERTscore': {stat: [score[stat] for score in bertscores]
+                                                for stat in ['precision', 'recall', 'f1']}}
+        return eval_metric_avg_scores, eval_metric_all_scores
@@ -0,0 +1,145 @@
+import numpy as np
+from multiprocessing import Pool
+from consts import *
+
+MAX_HASH = np.uint64(2 ** 32 - 1)
+SHINGLE_HASH_BASE = np.uint64(1000003)
+
+
+def make_permutations(num_perm, seed=0):
+    """
+    draws the parameters of the multiply-shift hash functions used as the MinHash permutations
+    :param num_perm: number of permutations
+    :param seed: random seed
+    :return: arrays of multipliers and offsets (uint64)
+    """
+    rng = np.random.default_rng(seed)
+    multipliers = rng.integers(1, 2 ** 63, num_perm, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+    offsets = rng.integers(0, 2 ** 63, num_perm, dtype=np.uint64)
+    return multipliers, offsets
+
+
+def shingle_hashes(text, shingle_size=SHINGLE_SIZE):
+    """
+    hashes the character shingles of a text (after lower-casing and collapsing whitespace)
+    :param text: the text
+    :param shingle_size: number of characters in a shingle
+    :return: array of unique shingle hashes (uint64)
+    """
+    text = ' '.join(text.lower().split())
+    chars = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32).astype(np.uint64)
+    num_shingles = max(len(chars) - shingle_size + 1, 1)
+    hashes = np.zeros(num_shingles, dtype=np.uint64)
+    for i in range(min(shingle_size, len(chars))):
+        hashes = hashes * SHINGLE_HASH_BASE + chars[i:i + num_shingles]
+    return np.unique(hashes)
+
+
+def compute_minhash_signatures(texts, num_perm=MINHASH_NUM_PERMUTATIONS, seed=0):
+    """
+    computes the MinHash signature of every text
+    :param texts: list of texts (non string or empty texts get a signature which matches nothing)
+    :param num_perm: number of permutations (signature length)
+    :param seed: random seed of the permutations
+    :return: signatures matrix of shape (number of texts, num_perm), uint32
+    """
+    multipliers, offsets = make_permutations(num_perm, seed)
+    signatures = np.full((len(texts), num_perm), MAX_HASH, dtype=np.uint64)
+    with np.errstate(over='ignore'):
+        for i, text in enumerate(texts):
+            if not isinstance(text, str) or len(text.strip()) == 0:
+                continue
+            hashes = shingle_hashes(text)
+            # multiply-shift hashing: the high 32 bits of (a * x + b) mod 2^64
+            permuted_hashes = (hashes[:, None] * multipliers[None, :] + offsets[None, :]) >> np.uint64(32)
+            signatures[i] = permuted_hashes.min(axis=0)
+    return signatures.astype(np.uint32)
+
+
+def compute_minhash_signatures_parallel(texts, num_workers=1, chunk_size=10000):
+    """
+    computes the MinHash signatures of the texts, splitting them between processes
+    :param texts: list of texts
+    :param num_workers: number of processes
+    :param chunk_size: number of texts per task
+    :return: signatures matrix (as in compute_minhash_signatures)
+    """
+    if num_workers <= 1:
+        return compute_minhash_signatures(texts)
+    chunks = [texts[i:i + chunk_size] for i in range(0, len(texts), chunk_size)]
+    with Pool(num_workers) as pool:
+        return np.concatenate(pool.map(compute_minhash_signatures, chunks))
+
+
+class UnionFind:
+    """
+    Disjoint sets of row indices
+    """
+
+    def __init__(self, size):
+        self.parents = np.arange(size)
+
+    def find(self, i):
+        root = i
+        while self.parents[root] != root:
+            root = self.parents[root]
+        while self.parents[i] != root:
+            self.parents[i], i = root, self.parents[i]
+        return root
+
+    def union(self, i, j):
+        root_i, root_j = self.find(i), self.find(j)
+        if root_i != root_j:
+            self.parents[max(root_i, root_j)] = min(root_i, root_j)
+
+    def roots(self):
+        """
+        :return: array of the root (smallest member) of the set of every index
+        """
+        return np.array([self.find(i) for i in range(len(self.parents))])
+
+
+def find_lsh_candidate_pairs(signatures, num_bands=LSH_NUM_BANDS):
+    """
+    finds pairs of rows which have an identical band of their signatures, without comparing all pairs
+    :param signatures: signatures matrix
+    :param num_bands: number of bands to split the signatures to (must divide the signature length)
+    :return: array of candidate pairs of row indices, shape (number of pairs, 2)
+    """
+    num_rows, num_perm = signatures.shape
+    rows_per_band = num_perm // num_bands
+    valid_rows = np.flatnonzero((signatures != np.uint32(MAX_HASH)).any(axis=1))
+    pairs = []
+    for band in range(num_bands):
+        band_values = np.ascontiguousarray(signatures[valid_rows, band * rows_per_band:(band + 1) * rows_per_band])
+        band_keys = band_values.view(np.dtype((np.void, band_values.dtype.itemsize * rows_per_band))).ravel()
+        _, bucket_ids = np.unique(band_keys, return_inverse=True)
+        order = np.argsort(bucket_ids, kind='stable')
+        sorted_bucket_ids = bucket_ids[order]
+        # pair every row with the first row of its bucket
+        bucket_starts = np.flatnonzero(np.r_[True, sorted_bucket_ids[1:] != sorted_bucket_ids[:-1]])
+        first_in_bucket = order[bucket_starts][np.searchsorted(bucket_starts, np.arange(len(order)), side='right') - 1]
+        is_pair = first_in_bucket != order
+        pairs.append(np.stack([valid_rows[first_in_bucket[is_pair]], valid_rows[order[is_pair]]], axis=1))
+    if len(pairs) == 0:
+        return np.empty((0, 2), dtype=int)
+    return np.unique(np.concatenate(pairs), axis=0)
+
+
+def find_near_duplicate_clusters(texts, threshold=NEAR_DUPLICATE_THRESHOLD, num_workers=1, union_find=None):
+    """
+    clusters near duplicate texts using MinHash signatures with LSH banding
+    :param texts: list of texts
+    :param threshold: min estimated Jaccard similarity (of character shingles) of near duplicates
+    :param num_workers: number of processes for computing the signatures
+    :param union_find: UnionFind to add the near duplicate pairs to (to combine several columns), optional
+    :return: UnionFind of the rows, where each set is a cluster of near duplicates
+    """
+    signatures = compute_minhash_signatures_parallel(list(texts), num_workers)
+    if union_find is None:
+        union_find = UnionFind(len(signatures))
+    candidate_pairs = find_lsh_candidate_pairs(signatures)
+    similarities = (signatures[candidate_pairs[:, 0]] == signatures[candidate_pairs[:, 1]]).mean(axis=1)
+    for i, j in candidate_pairs[similarities >= threshold]:
+        union_find.union(i, j)
+    return union_find
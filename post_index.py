@@ -0,0 +1,79 @@
+import os
+import json
+import hashlib
+from glob import glob
+from consts import *
+
+
+class PostIndex:
+    """
+    Persistent index of the posts in the posts dir (post id -> external link), which records the json files already
+    ingested (by mtime and hash) so that only new or changed files are parsed
+    """
+
+    def __init__(self, index_path):
+        """
+        :param index_path: path to the index json file
+        """
+        self.index_path = index_path
+        self.__files = {}
+        self.__posts = {}
+        if os.path.exists(index_path):
+            with open(index_path, 'r') as f:
+                index = json.load(f)
+            self.__files = index['files']
+            self.__posts = index['posts']
+
+    def update(self, data_dir):
+        """
+        ingests the json files in the posts dir which were not ingested before (or changed since)
+        :param data_dir: path to a posts directory
+        :return: number of ingested files
+        """
+        num_ingested = 0
+        for path in sorted(glob(f'{data_dir}/*.json')):
+            name = os.path.basename(path)
+            stat = os.stat(path)
+            known_file = self.__files.get(name)
+            if known_file is not None and known_file['mtime'] == stat.st_mtime and known_file['size'] == stat.st_size:
+                continue
+            content_hash = hashlib.sha1()
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(2 ** 20), b''):
+                    content_hash.update(block)
+                file_hash = content_hash.hexdigest()
+                if known_file is None or known_file['hash'] != file_hash:
+                    f.seek(0)
+                    for post_id, post in json.load(f).items():
+                        self.__posts[post_id] = post['ext_link']
+                    num_ingested += 1
+            self.__files[name] = {'mtime': stat.st_mtime, 'size': stat.st_size, 'hash': file_hash}
+        return num_ingested
+
+    def __contains__(self, post_id):
+        return post_id in self.__posts
+
+    def __len__(self):
+        return len(self.__posts)
+
+    def get_post_ids(self):
+        """
+        :return: set of the ids of all indexed posts
+        """
+        return set(self.__posts)
+
+    def get_links(self):
+        """
+        :return: list of the external links of all indexed posts, without duplicates
+        """
+        return list(dict.fromkeys(self.__posts.values()))
+
+    def save(self):
+        """
+        saves the index to its json file
+        """
+        os.makedirs(os.path.dirname(self.index_path) or '.', exist_ok=True)
+        tmp_path = f'{self.index_path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'files': self.__files, 'posts': self.__posts}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.index_path)
@@ -0,0 +1,182 @@
+import os
+import re
+import html
+import gzip
+import json
+import urllib
+from glob import glob
+from multiprocessing import Pool
+from consts import *
+from html_parsing import parse_html
+
+LINK_REGEX = re.compile(LINK_PATTERN)
+BAIT_REGEX_1 = re.compile(BAIT_PATTERN_1)
+BAIT_REGEX_2 = re.compile(BAIT_PATTERN_2)
+BAIT_REGEX_3 = re.compile(BAIT_PATTERN_3)
+
+
+def get_external_link(html_text):
+    """
+    gets the external link from the HTML of a post
+    :param html_text: inner HTML of the post element
+    :return: external link string
+    """
+    link = LINK_REGEX.search(html_text).group(1)
+    return html.unescape(urllib.parse.unquote(link))
+
+
+def get_bait(html_text):
+    """
+    gets the clickbait title from the HTML of a post
+    :param html_text: inner HTML of the post element
+    :return: clickbait string
+    """
+    try:
+        res = BAIT_REGEX_1.findall(html_text)
+        assert len(res) > 1
+        bait = html.unescape(res[-1])
+        if bait == '':
+            res = BAIT_REGEX_2.findall(html_text)
+            assert len(res) > 1
+            bait = html.unescape(res[-1])
+        return bait
+    except:
+        res = BAIT_REGEX_3.findall(html_text)
+        if len(res) == 0:
+            raise Exception("No bait found")
+        bait = html.unescape(res[0])
+        return bait
+
+
+def get_post_content(html_text, layout):
+    """
+    gets the text of a post from its HTML (the offline counterpart of the scraper's content finder). The HTML is
+    captured without expanding "See more", so the text of long posts is cut where the feed cuts it
+    :param html_text: inner HTML of the post element
+    :param layout: Facebook layout the post was captured in ('old' or 'new')
+    :return: post text, or an empty string for posts without text (e.g. a link or an image only)
+    """
+    page = parse_html(html_text)
+    node = page.select_one(POST_CONTENT_SELECTORS[layout])
+    if node is None:
+        return ""
+    return page.text(node).strip()
+
+
+class SnapshotWriter:
+    """
+    Appends the raw HTML of captured posts to a gzip compressed json lines snapshot file, to be parsed later by
+    parse_snapshot
+    """
+
+    def __init__(self, snapshot_path, compress_level=SNAPSHOT_COMPRESS_LEVEL):
+        """
+        :param snapshot_path: path to the snapshot file (.jsonl.gz)
+        :param compress_level: gzip compression level (low levels keep up with scrolling)
+        """
+        os.makedirs(os.path.dirname(snapshot_path) or '.', exist_ok=True)
+        self.snapshot_path = snapshot_path
+        self.__file = gzip.open(snapshot_path, 'wt', encoding='utf8', compresslevel=compress_level)
+        self.num_posts = 0
+
+    def write(self, post_id, post_url, layout, html_text):
+        """
+        appends a captured post to the snapshot
+        :param post_id: id of the post
+        :param post_url: url of the post
+        :param layout: Facebook layout of the page ('old' or 'new')
+        :param html_text: inner HTML of the post element
+        """
+        self.__file.write(json.dumps({'post_id': post_id, 'post_url': post_url, 'layout': layout, 'html': html_text},
+                                     ensure_ascii=False) + '\n')
+        self.num_posts += 1
+
+    def close(self):
+        self.__file.close()
+
+
+def iter_snapshot_records(snapshot_path):
+    """
+    lazily yields the captured posts of a snapshot file
+    :param snapshot_path: path to a snapshot file
+    :return: generator of captured post dictionaries (post_id, post_url, layout, html)
+    """
+    with gzip.open(snapshot_path, 'rt', encoding='utf8') as f:
+        for line in f:
+            # a capture which was killed may end with a partial line
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                return
+
+
+def parse_snapshot_record(record):
+    """
+    extracts the post fields saved by save_clickbaits from a captured post
+    :param record: captured post dictionary
+    :return: post id, post dictionary (or None on failure) and error message (or None)
+    """
+    try:
+        html_text = record['html']
+        return record['post_id'], {"content": get_post_content(html_text, record['layout']),
+                                   "post_url": record['post_url'],
+                                   "ext_link": get_external_link(html_text),
+                                   "bait": get_bait(html_text)}, None
+    except Exception as ex:
+        return record['post_id'], None, f'{type(ex).__name__}: {ex}'
+
+
+def get_snapshot_posts_path(snapshot_path, data_dir):
+    """
+    :param snapshot_path: path to a snapshot file
+    :param data_dir: path to a posts directory
+    :return: path of the posts json file parsed from the snapshot (named after the snapshot)
+    """
+    return os.path.join(data_dir, os.path.basename(snapshot_path)[:-len(SNAPSHOT_EXTENSION)] + '.json')
+
+
+def parse_snapshot(snapshot_path, data_dir, num_workers=1):
+    """
+    parses a snapshot file into a posts json file in the format of save_clickbaits, splitting the posts between
+    processes. Re-parsing a snapshot overwrites its posts file
+    :param snapshot_path: path to a snapshot file
+    :param data_dir: path to the posts directory to write the json file to
+    :param num_workers: number of processes
+    :return: number of parsed posts, and list of (post id, error message) of the posts which failed
+    """
+    data = {}
+    errors = []
+    records = iter_snapshot_records(snapshot_path)
+    if num_workers > 1:
+        with Pool(num_workers) as pool:
+            results = list(pool.imap(parse_snapshot_record, records, chunksize=SNAPSHOT_PARSE_CHUNK_SIZE))
+    else:
+        results = map(parse_snapshot_record, records)
+    for post_id, post, error in results:
+        if post is None:
+            errors.append((post_id, error))
+        else:
+            data[post_id] = post
+    with open(get_snapshot_posts_path(snapshot_path, data_dir), 'w') as f:
+        json.dump(data, f, indent=3, ensure_ascii=False)
+    return len(data), errors
+
+
+def parse_snapshots(data_dir, num_workers=1, reparse=False):
+    """
+    parses the snapshot files of the posts dir into posts json files
+    :param data_dir: path to a posts directory
+    :param num_workers: number of processes
+    :param reparse: if True snapshots which were already parsed are parsed again (e.g. after fixing the patterns)
+    :return: number of parsed snapshot files
+    """
+    num_parsed = 0
+    for snapshot_path in sorted(glob(os.path.join(data_dir, SNAPSHOT_DIR_NAME, f'*{SNAPSHOT_EXTENSION}'))):
+        if not reparse and os.path.exists(get_snapshot_posts_path(snapshot_path, data_dir)):
+            continue
+        num_posts, errors = parse_snapshot(snapshot_path, data_dir, num_workers)
+        for post_id, error in errors:
+            print(f'{post_id}: {error}')
+        print(f'Parsed {num_posts} posts from {snapshot_path}, {len(errors)} errors')
+        num_parsed += 1
+    return num_parsed
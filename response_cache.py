@@ -0,0 +1,146 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from consts import *
+
+
+class ResponseCache:
+    """
+    On-disk cache of raw article HTML, keyed by the hash of the normalized article url. Each entry keeps the
+    ETag/Last-Modified headers and the fetch time so stale entries can be revalidated with a conditional GET
+    """
+
+    def __init__(self, cache_dir, ttl=CACHE_TTL, max_age=CACHE_MAX_AGE, max_size=CACHE_MAX_SIZE, offline=False):
+        """
+        :param cache_dir: path to the cache directory
+        :param ttl: number of seconds an entry is served without revalidation
+        :param max_age: number of seconds after which an entry is evicted
+        :param max_size: max total size (in bytes) of the cached HTML, oldest entries are evicted first
+        :param offline: if True entries are always served as is and nothing is fetched
+        """
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_age = max_age
+        self.max_size = max_size
+        self.offline = offline
+        self.stats = {'hits': 0, 'revalidated': 0, 'stale': 0, 'misses': 0}
+        self.__lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def __entry_paths(self, url):
+        """
+        :param url: normalized url
+        :return: paths of the HTML file and the metadata file of the url's entry
+        """
+        key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        entry_dir = os.path.join(self.cache_dir, key[:2])
+        return os.path.join(entry_dir, f'{key}.html'), os.path.join(entry_dir, f'{key}.meta')
+
+    def get(self, url):
+        """
+        gets the cached entry of the url
+        :param url: normalized url
+        :return: raw HTML and metadata dictionary, or None if the url is not cached
+        """
+        html_path, meta_path = self.__entry_paths(url)
+        try:
+            with open(meta_path, 'r') as f:
+                meta = json.load(f)
+            with open(html_path, 'rb') as f:
+                content = f.read()
+        except (OSError, ValueError):
+            return None
+        return content, meta
+
+    def is_fresh(self, meta):
+        """
+        :param meta: metadata dictionary of an entry
+        :return: True if the entry can be served without revalidation
+        """
+        return self.offline or time.time() - meta['fetch_time'] < self.ttl
+
+    @staticmethod
+    def conditional_headers(meta):
+        """
+        :param meta: metadata dictionary of an entry
+        :return: headers for revalidating the entry with a conditional GET
+        """
+        headers = {}
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+        return headers
+
+    def __write_meta(self, meta_path, meta):
+        tmp_path = f'{meta_path}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, meta_path)
+
+    def put(self, url, content, headers):
+        """
+        stores a fetched response
+        :param url: normalized url
+        :param content: raw HTML
+        :param headers: response headers
+        """
+        html_path, meta_path = self.__entry_paths(url)
+        os.makedirs(os.path.dirname(html_path), exist_ok=True)
+        tmp_path = f'{html_path}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(content)
+        os.replace(tmp_path, html_path)
+        self.__write_meta(meta_path, {'url': url, 'etag': headers.get('ETag'),
+                                      'last_modified': headers.get('Last-Modified'),
+                                      'fetch_time': time.time(), 'size': len(content)})
+
+    def touch(self, url, meta):
+        """
+        marks an entry as revalidated now (after a 304 response)
+        :param url: normalized url
+        :param meta: metadata dictionary of the entry
+        """
+        meta['fetch_time'] = time.time()
+        self.__write_meta(self.__entry_paths(url)[1], meta)
+
+    def record(self, stat):
+        """
+        increments one of the hit/revalidated/stale/miss counters
+        :param stat: name of the counter
+        """
+        with self.__lock:
+            self.stats[stat] += 1
+
+    def evict(self):
+        """
+        removes entries older than max_age, then the oldest entries until the cache fits in max_size
+        :return: number of removed entries
+        """
+        entries = []
+        for entry_dir in os.scandir(self.cache_dir):
+            if not entry_dir.is_dir():
+                continue
+            for entry in os.scandir(entry_dir.path):
+                if entry.name.endswith('.meta'):
+                    try:
+                        with open(entry.path, 'r') as f:
+                            meta = json.load(f)
+                    except (OSError, ValueError):
+                        continue
+                    entries.append((meta['fetch_time'], meta['size'], entry.path))
+        entries.sort()
+        total_size = sum(size for _, size, _ in entries)
+        now = time.time()
+        num_removed = 0
+        for fetch_time, size, meta_path in entries:
+            if now - fetch_time < self.max_age and total_size <= self.max_size:
+                break
+            for path in (meta_path, meta_path[:-len('.meta')] + '.html'):
+                if os.path.exists(path):
+                    os.remove(path)
+            total_size -= size
+            num_removed += 1
+        return num_removed
@@ -1,18 +1,154 @@
 import os
+import csv
 import json
+import time
+import queue
 import requests
 import argparse
+import threading
+from urllib.parse import urlparse
+from contextlib import contextmanager
+from urllib3.util.retry import Retry
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import pandas as pd
 from tqdm import tqdm
-from glob import glob
 from consts import *
-from bs4 import BeautifulSoup
+from html_parsing import parse_html, PARSER_BACKENDS, DEFAULT_PARSER_BACKEND
+from response_cache import ResponseCache
+from link_ledger import LinkLedger
+from url_resolver import ShortLinkResolver
+from post_index import PostIndex
+from instrumentation import timer, increment, observe, write_report, profiled
 from selenium import webdriver
-from clickbait_scraper import save_clickbaits
+from clickbait_scraper import save_clickbaits, capture_clickbaits
+from post_parsing import parse_snapshots
 from selenium.webdriver.chrome.options import Options
 from news_scrapers.hebrew.israelhayom import IsraelhayomScraper
 
 
+class HostSessionPool:
+    """
+    Keeps a pooled keep-alive session per host, with timeouts, retries with exponential backoff on retryable
+    status codes and a minimal interval between consecutive requests to the same host
+    """
+
+    def __init__(self, timeout=HTTP_TIMEOUT, max_retries=HTTP_MAX_RETRIES, backoff_factor=HTTP_BACKOFF_FACTOR,
+                 min_request_interval=HOST_MIN_REQUEST_INTERVAL, pool_size=HTTP_POOL_SIZE):
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.min_request_interval = min_request_interval
+        self.pool_size = pool_size
+        self.__lock = threading.Lock()
+        self.__sessions = {}
+        self.__host_locks = {}
+        self.__last_request_times = {}
+
+    def __get_session(self, host):
+        """
+        gets the session of the given host, creating it on first use
+        :param host: host name
+        :return: requests session for the host
+        """
+        with self.__lock:
+            if host not in self.__sessions:
+                retry = Retry(total=self.max_retries, backoff_factor=self.backoff_factor,
+                              status_forcelist=HTTP_RETRY_STATUS_CODES, allowed_methods=['HEAD', 'GET'],
+                              raise_on_status=False)
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=retry)
+                session = requests.Session()
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self.__sessions[host] = session
+                self.__host_locks[host] = threading.Lock()
+                self.__last_request_times[host] = 0
+            return self.__sessions[host]
+
+    def __wait_for_turn(self, host):
+        """
+        sleeps until at least min_request_interval seconds passed since the last request to the host
+        :param host: host name
+        """
+        with self.__host_locks[host]:
+            wait_time = self.__last_request_times[host] + self.min_request_interval - time.monotonic()
+            if wait_time > 0:
+                time.sleep(wait_time)
+            self.__last_request_times[host] = time.monotonic()
+
+    def request(self, method, url, **kwargs):
+        """
+        sends a request through the session of the url's host
+        :param method: HTTP method
+        :param url: string url
+        :return: requests response
+        """
+        host = urlparse(url).netloc
+        session = self.__get_session(host)
+        self.__wait_for_turn(host)
+        kwargs.setdefault('timeout', self.timeout)
+        return session.request(method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def head(self, url, **kwargs):
+        return self.request('HEAD', url, **kwargs)
+
+    def close(self):
+        """
+        closes all the sessions
+        """
+        with self.__lock:
+            for session in self.__sessions.values():
+                session.close()
+            self.__sessions.clear()
+
+
+session_pool = HostSessionPool()
+short_link_resolver = ShortLinkResolver(session_pool)
+response_cache = None
+
+
+def fetch_html(url):
+    """
+    fetches the raw HTML of the url, going through the response cache when one is set. If revalidating a cached
+    entry fails (a connection error or a 5xx response), the cached HTML is served instead
+    :param url: normalized url (as returned from transform_url)
+    :return: raw HTML bytes
+    """
+    if response_cache is None:
+        return session_pool.get(url).content
+    headers = {}
+    cached = response_cache.get(url)
+    if cached is not None:
+        content, meta = cached
+        if response_cache.is_fresh(meta):
+            response_cache.record('hits')
+            return content
+        headers = response_cache.conditional_headers(meta)
+    elif response_cache.offline:
+        raise Exception("Article is not cached (offline mode)")
+    try:
+        r = session_pool.get(url, headers=headers)
+    except requests.RequestException:
+        if cached is None:
+            raise
+        response_cache.record('stale')
+        return content
+    if cached is not None and r.status_code >= 500:
+        response_cache.record('stale')
+        return content
+    if cached is not None and r.status_code == 304:
+        response_cache.touch(url, meta)
+        response_cache.record('revalidated')
+        return content
+    response_cache.record('misses')
+    if r.status_code == 200:
+        response_cache.put(url, r.content, r.headers)
+    return r.content
+
+
 def create_browser():
     """
     creates a browser for scraping
@@ -25,31 +161,155 @@ def create_browser():
     return browser
 
 
+class BrowserPool:
+    """
+    Bounded pool of reusable browsers, which are only started when first needed
+    """
+
+    def __init__(self, max_size=BROWSER_POOL_SIZE):
+        self.max_size = max_size
+        self.__idle_browsers = queue.LifoQueue()
+        self.__browsers = []
+        self.__num_started = 0
+        self.__lock = threading.Lock()
+
+    def __acquire(self):
+        """
+        takes an idle browser, starts a new one if the pool is not full, or else waits for a browser to be released
+        :return: a selenium browser
+        """
+        try:
+            return self.__idle_browsers.get_nowait()
+        except queue.Empty:
+            pass
+        with self.__lock:
+            is_pool_full = self.__num_started >= self.max_size
+            if not is_pool_full:
+                self.__num_started += 1
+        if is_pool_full:
+            return self.__idle_browsers.get()
+        try:
+            browser = create_browser()
+        except Exception:
+            with self.__lock:
+                self.__num_started -= 1
+            raise
+        with self.__lock:
+            self.__browsers.append(browser)
+        return browser
+
+    @contextmanager
+    def browser(self):
+        """
+        context manager lending a browser from the pool
+        """
+        browser = self.__acquire()
+        try:
+            yield browser
+        finally:
+            self.__idle_browsers.put(browser)
+
+    def close(self):
+        """
+        quits all the started browsers
+        """
+        with self.__lock:
+            for browser in self.__browsers:
+                browser.quit()
+            self.__browsers.clear()
+            self.__num_started = 0
+            self.__idle_browsers = queue.LifoQueue()
+
+
+browser_pool = BrowserPool()
+israelhayom_scrapers = threading.local()
+
+
+def get_israelhayom_scraper():
+    """
+    gets the Israel Hayom scraper of the current thread, creating it on first use
+    :return: IsraelhayomScraper object
+    """
+    if not hasattr(israelhayom_scrapers, 'scraper'):
+        israelhayom_scrapers.scraper = IsraelhayomScraper()
+    return israelhayom_scrapers.scraper
+
+
+force_https = True
+
+
+@timer('transform_url')
 def transform_url(url):
     """
     checks if the url is shortened, if so it corrects it
     :param url: string url
-    :return: a long version of the url
+    :return: a long version of the url (with an https scheme, unless force_https is turned off)
     """
     if SHORTEN_CODE in url:
-        url = requests.head(url).headers['location']
-    url = url.replace('http:', 'https:')
+        url = short_link_resolver.resolve(url)
+    if force_https:
+        url = url.replace('http:', 'https:')
     url = url.split('?')[0].split('#')[0]
     return url
 
 
-def scrape_from_tmi(url):
+SITE_EXTRACTORS = {}
+SITE_FETCH_OVERRIDES = {}
+parser_backend = DEFAULT_PARSER_BACKEND
+
+
+def register_extractor(domain):
+    """
+    registers the decorated function as the extractor of a site, i.e. the function which extracts the article title
+    and body from a parsed article page of the site
+    :param domain: domain prefix of the site
+    """
+    def decorator(extractor):
+        SITE_EXTRACTORS[domain] = extractor
+        return extractor
+    return decorator
+
+
+def register_fetch_override(domain):
+    """
+    registers the decorated function as the fetch override of a site, i.e. the function which scrapes the article
+    title and body from the url itself, for sites which can't be fetched with fetch_html and parsed by an extractor
+    :param domain: domain prefix of the site
+    """
+    def decorator(scrape):
+        SITE_FETCH_OVERRIDES[domain] = scrape
+        return scrape
+    return decorator
+
+
+def extract_article(content, extractor):
     """
-    scrapes the article from TMI
-    :param url: url to an article in TMI
+    parses the raw HTML with the current parser backend and extracts the article from it, falling back to
+    BeautifulSoup if extraction with a fast backend fails
+    :param content: raw HTML of the article page
+    :param extractor: extractor function of the site
     :return: article title, article body
     """
-    r = requests.get(url)
-    soup = BeautifulSoup(r.content, 'html.parser')
-    cur_title = soup.select_one('title').text.strip()
-    all_script = soup.find_all('script', {'type': 'application/ld+json'})
+    if parser_backend == 'bs4':
+        return extractor(parse_html(content, 'bs4'))
+    try:
+        return extractor(parse_html(content, parser_backend))
+    except Exception:
+        increment('parser_fallbacks', backend=parser_backend, extractor=extractor.__name__)
+        return extractor(parse_html(content, 'bs4'))
+
+
+@register_extractor(TMI_PREFIX)
+def extract_from_tmi(page):
+    """
+    extracts the article from a TMI page
+    :param page: parsed article page
+    :return: article title, article body
+    """
+    cur_title = page.text(page.select_one('title')).strip()
+    all_script = page.select('script[type="application/ld+json"]')
     for script in all_script:
-        script_text = script.getText()
+        script_text = page.text(script)
         if "articleBody" in script_text:
             start_inx = script_text.find("articleBody")
             cur_body = script_text[start_inx:]
@@ -59,43 +319,24 @@ def scrape_from_tmi(url):
     raise Exception("No article body found")
 
 
-def scrape_from_israelhayom(url, browser):
+@register_extractor(MAKO_PREFIX)
+def extract_from_mako(page):
     """
-    scrapes the article from Israel Hayom
-    :param url: url to an article in Israel Hayom
+    extracts the article from a Mako page
+    :param page: parsed article page
     :return: article title, article body
     """
-    scraper = IsraelhayomScraper()
-    html = scraper.fetcher.fetch(url)
-    article = scraper._process_page((html, url))[0]
-    if len(article.text) > 0:
-        return article.title, article.text
-    browser.get(url)
-    html = scraper.fetcher.fetch(url)
-    article = scraper._process_page((html, url))[0]
-    assert len(article.text) > 0, "No text found"
-    return article.title, article.text
-
-
-def scrape_from_mako(url):
-    """
-    scrapes the article from Mako
-    :param url: url to an article in Mako
-    :return: article title, article body
-    """
-    r = requests.get(url)
-    soup = BeautifulSoup(r.content, 'html.parser')
-    all_p = soup.find_all('p', attrs={'class': 'Standard'})
-    text = ' '.join([a.text for a in all_p])
+    all_p = page.select('p.Standard')
+    text = ' '.join([page.text(a) for a in all_p])
     body = text
     if len(body) < 20:
         text = ""
-        p_tags = soup.find_all('p', attrs=None)
+        p_tags = page.select('p')
         for tag in p_tags:
-            text = text + tag.get_text()
+            text = text + page.text(tag)
         body = text.replace('\n\n','')
-    script = soup.find_all('script', {'type': 'application/ld+json'})[0]
-    script_text = script.getText()
+    script = page.select('script[type="application/ld+json"]')[0]
+    script_text = page.text(script)
     start_inx = script_text.find("headline")
     cur_title = script_text[start_inx:]
     end_ind = cur_title.find("\n")
@@ -103,77 +344,241 @@ def scrape_from_mako(url):
     return cur_title, body
 
 
-def scrape_from_walla(url):
+@register_extractor(WALLA_PREFIX)
+def extract_from_walla(page):
     """
-    scrapes the article from Walla
-    :param url: url to an article in Walla
+    extracts the article from a Walla page
+    :param page: parsed article page
     :return: article title, article body
     """
-    r = requests.get(url)
-    soup = BeautifulSoup(r.content, 'html.parser')
-    text = ' '.join([a.text.strip() for a in soup.find_all('p', attrs={'class': 'article_speakable'})[1:]])
+    text = ' '.join([page.text(a).strip() for a in page.select('p.article_speakable')[1:]])
     assert len(text) > 0, "No text found"
-    title = soup.select_one('h1').text.strip()
+    title = page.text(page.select_one('h1')).strip()
     return title, text
 
 
-def save_to_csv(output_file, all_titles, all_links, all_bodies):
+@register_fetch_override(ISRAELHAYOM_PREFIX)
+def scrape_from_israelhayom(url):
     """
-    saves the data to a csv file
-    :param output_file: output path to csv file
-    :param all_titles: list of titles
-    :param all_links: list of links
-    :param all_bodies: list of article contents
+    scrapes the article from Israel Hayom, rendering the page in a browser only if the static page has no text
+    :param url: url to an article in Israel Hayom
+    :return: article title, article body
+    """
+    scraper = get_israelhayom_scraper()
+    html = scraper.fetcher.fetch(url)
+    article = scraper._process_page((html, url))[0]
+    if len(article.text) > 0:
+        return article.title, article.text
+    with browser_pool.browser() as browser:
+        browser.get(url)
+        html = browser.page_source
+    article = scraper._process_page((html, url))[0]
+    assert len(article.text) > 0, "No text found"
+    return article.title, article.text
+
+
+class ArticleCsvWriter:
     """
-    data = {'Title': all_titles,
-            'Body': all_bodies, 'Link': all_links}
-    df = pd.DataFrame(data).drop_duplicates()
-    df.to_csv(output_file, encoding='utf-8-sig')
+    Writes scraped articles to the output csv as they arrive (utf-8 with a BOM, an index column followed by the Title,
+    Body and Link columns), writing every link at most once
+    """
+
+    def __init__(self, output_file, append=False):
+        """
+        :param output_file: output path to csv file
+        :param append: if True continues an existing csv (of a resumed run), else starts a new one
+        """
+        self.__written_links = set()
+        self.__num_rows = 0
+        if append and os.path.exists(output_file):
+            existing_df = pd.read_csv(output_file, encoding='utf-8-sig')
+            self.__written_links.update(existing_df['Link'])
+            self.__num_rows = len(existing_df)
+            self.__file = open(output_file, 'a', encoding='utf-8', newline='')
+            self.__writer = csv.writer(self.__file, lineterminator='\n')
+        else:
+            self.__file = open(output_file, 'w', encoding='utf-8-sig', newline='')
+            self.__writer = csv.writer(self.__file, lineterminator='\n')
+            self.__writer.writerow(['', 'Title', 'Body', 'Link'])
+
+    def write(self, title, body, link):
+        """
+        appends an article to the csv (links which were already written are ignored)
+        :param title: article title
+        :param body: article content
+        :param link: link to the article
+        """
+        if link in self.__written_links:
+            return
+        self.__writer.writerow([self.__num_rows, title, body, link])
+        self.__file.flush()
+        self.__written_links.add(link)
+        self.__num_rows += 1
+
+    def close(self):
+        self.__file.close()
 
 
 def load_data(data_dir):
     """
-    loads the links from the json files
+    loads the links from the json files, parsing only the files which were not indexed in previous runs
     :param data_dir: path to a posts directory
-    :return: a list of post links
+    :return: a list of post links, without duplicates
+    """
+    post_index = PostIndex(os.path.join(data_dir, SCRAPER_STATE_DIR_NAME, POST_INDEX_NAME))
+    num_new_files = post_index.update(data_dir)
+    post_index.save()
+    print(f'Indexed {num_new_files} new posts files, {len(post_index)} posts in total')
+    return post_index.get_links()
+
+
+def get_domain(url):
+    """
+    finds the supported news site the url belongs to
+    :param url: string url
+    :return: the matching domain prefix, or None if the site is not supported
+    """
+    for domain in DOMAIN_CONCURRENCY_LIMITS:
+        if domain in url:
+            return domain
+    return None
+
+
+@contextmanager
+def count_extraction(extractor_name):
+    """
+    counts the successful and the failed extractions (the enclosed block) of an extractor
+    :param extractor_name: name of the extractor
     """
-    data = dict()
-    paths = glob(f'{data_dir}/*.json')
-    for path in paths:
-        with open(path, 'r') as f:
-            data.update(json.load(f))
-    return [post['ext_link'] for post in data.values()]
+    try:
+        yield
+    except Exception:
+        increment('extractions', extractor=extractor_name, status='failure')
+        raise
+    increment('extractions', extractor=extractor_name, status='success')
 
 
-def get_articles(links):
+def scrape_article(link, domain_semaphores):
     """
-    scrapes the articles from the links
+    scrapes a single article, respecting the concurrency limit of its domain
+    :param link: link to the article (as it appears in the post)
+    :param domain_semaphores: dictionary of domain to semaphore bounding the concurrent requests to it
+    :return: article title and article body, or None if the site is not supported
+    """
+    cur_url = transform_url(link)
+    domain = get_domain(cur_url)
+    if domain is None:
+        return None
+    with domain_semaphores[domain]:
+        start = time.perf_counter()
+        try:
+            if domain in SITE_FETCH_OVERRIDES:
+                with count_extraction(SITE_FETCH_OVERRIDES[domain].__name__):
+                    return SITE_FETCH_OVERRIDES[domain](cur_url)
+            content = fetch_html(cur_url)
+        finally:
+            observe('fetch_latency_seconds', time.perf_counter() - start, domain=domain)
+    with count_extraction(SITE_EXTRACTORS[domain].__name__), timer('extract', domain=domain):
+        return extract_article(content, SITE_EXTRACTORS[domain])
+
+
+def iter_articles(links, num_workers=1):
+    """
+    scrapes the articles from the links using a bounded pool of worker threads, yielding them as they finish
     :param links: list of links
-    :return: list of titles, list of links, list of article contents
-    """
-    all_titles = []
-    all_bodies = []
-    all_links = []
-    browser = create_browser()
-    for link in tqdm(links):
-        cur_url = transform_url(link)
+    :param num_workers: number of articles to scrape concurrently
+    :return: generator of (index of the link, link, (title, body) or None if the site is not supported, error message
+    or None)
+    """
+    short_link_resolver.resolve_all([link for link in links if SHORTEN_CODE in link],
+                                    max(num_workers, RESOLVE_NUM_WORKERS))
+    domain_semaphores = {domain: threading.BoundedSemaphore(limit)
+                         for domain, limit in DOMAIN_CONCURRENCY_LIMITS.items()}
+
+    def scrape(link):
         try:
-            if TMI_PREFIX in cur_url:
-                title, body = scrape_from_tmi(cur_url)
-            elif ISRAELHAYOM_PREFIX in cur_url:
-                title, body = scrape_from_israelhayom(cur_url, browser)
-            elif MAKO_PREFIX in cur_url:
-                title, body = scrape_from_mako(cur_url)
-            elif WALLA_PREFIX in cur_url:
-                title, body = scrape_from_walla(cur_url)
-            else:
-                continue
-            all_titles.append(title)
-            all_bodies.append(body)
-            all_links.append(link)
+            return scrape_article(link, domain_semaphores), None
         except Exception as e:
-            print(f'Error when scraping article from {cur_url}, error: {e}')
-    return all_titles, all_links, all_bodies
+            return None, str(e)
+
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        futures = {executor.submit(scrape, link): i for i, link in enumerate(links)}
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            i = futures[future]
+            article, error = future.result()
+            yield i, links[i], article, error
+
+
+def print_cache_stats():
+    """
+    prints the hit/miss counts of the response cache (if used)
+    """
+    if response_cache is not None:
+        print(f"Response cache: {response_cache.stats['hits']} hits, {response_cache.stats['revalidated']} revalidated, "
+              f"{response_cache.stats['stale']} served stale, {response_cache.stats['misses']} misses")
+
+
+def get_articles(links, num_workers=1):
+    """
+    scrapes the articles from the links into memory (scrape_articles_to_csv writes them to a csv as they finish
+    instead), using a bounded pool of worker threads
+    :param links: list of links
+    :param num_workers: number of articles to scrape concurrently
+    :return: list of titles, list of links, list of article contents (in the order of the given links), and a list
+    of errors, each a dictionary with the failed link and the error message
+    """
+    articles = [None] * len(links)
+    errors = []
+    for i, link, article, error in iter_articles(links, num_workers):
+        if error is not None:
+            errors.append((i, {'link': link, 'error': error}))
+        articles[i] = article
+    all_titles = [article[0] for article in articles if article is not None]
+    all_bodies = [article[1] for article in articles if article is not None]
+    all_links = [link for link, article in zip(links, articles) if article is not None]
+    print_cache_stats()
+    return all_titles, all_links, all_bodies, [error for _, error in sorted(errors, key=lambda e: e[0])]
+
+
+def scrape_articles_to_csv(links, output_file, ledger, num_workers=1, resume=False):
+    """
+    scrapes the articles from the links, writing each article to the csv and its status to the ledger as it finishes
+    :param links: list of links
+    :param output_file: output path to csv file
+    :param ledger: LinkLedger of the run
+    :param num_workers: number of articles to scrape concurrently
+    :param resume: if True appends to the csv of a previous run
+    :return: number of scraped articles, and a list of errors (as in get_articles)
+    """
+    writer = ArticleCsvWriter(output_file, append=resume)
+    num_articles = 0
+    errors = []
+    try:
+        for _, link, article, error in iter_articles(links, num_workers):
+            if error is not None:
+                errors.append({'link': link, 'error': error})
+                ledger.record(link, LINK_STATUS_FAILED, error)
+            elif article is None:
+                ledger.record(link, LINK_STATUS_SKIPPED, "Unsupported domain")
+            else:
+                title, body = article
+                writer.write(title, body, link)
+                ledger.record(link, LINK_STATUS_DONE)
+                num_articles += 1
+    finally:
+        writer.close()
+    print_cache_stats()
+    return num_articles, errors
+
+
+def save_errors(output_file, errors):
+    """
+    saves the scraping errors to a json file next to the output csv
+    :param output_file: output path to csv file
+    :param errors: list of errors, as returned by get_articles
+    """
+    with open(f'{os.path.splitext(output_file)[0]}_errors.json', 'w') as f:
+        json.dump(errors, f, indent=3, ensure_ascii=False)
 
 
 def parse_args():
@@ -183,16 +588,76 @@ def parse_args():
     parser.add_argument('--num-links', '-n', type=int, help='number of links to scrape', default=100)
     parser.add_argument('--save-clickbaits', '-s', action='store_true', help='get new clickbaits', default=False)
     parser.add_argument('--num-posts', '-p', type=int, help='number of posts to scrape (only with --save-clickbaits)', default=100)
+    parser.add_argument('--full-refresh', action='store_true', default=False,
+                        help='with --save-clickbaits or --capture-clickbaits, keep scrolling past the posts saved in previous runs')
+    parser.add_argument('--capture-clickbaits', action='store_true', default=False,
+                        help='get new clickbaits as a raw HTML snapshot only (parsed with --parse-snapshots)')
+    parser.add_argument('--parse-snapshots', action='store_true', default=False,
+                        help='parse the captured snapshots which were not parsed yet into posts files')
+    parser.add_argument('--reparse-snapshots', action='store_true', default=False,
+                        help='with --parse-snapshots, parse all the captured snapshots again, without network access')
+    parser.add_argument('--parse-workers', type=int, help='number of processes for parsing snapshots', default=1)
+    parser.add_argument('--num-workers', '-w', type=int, help='number of articles to scrape concurrently', default=1)
+    parser.add_argument('--timeout', type=float, help='timeout (in seconds) of a single request', default=HTTP_TIMEOUT)
+    parser.add_argument('--max-retries', type=int, help='max retries of a failed request', default=HTTP_MAX_RETRIES)
+    parser.add_argument('--min-request-interval', type=float, help='min seconds between two requests to the same host',
+                        default=HOST_MIN_REQUEST_INTERVAL)
+    parser.add_argument('--cache-dir', type=str, help='path to the response cache dir (default: inside the posts dir)')
+    parser.add_argument('--no-cache', action='store_true', help="don't cache article responses", default=False)
+    parser.add_argument('--cache-ttl', type=float, help='seconds a cached article is used without revalidation',
+                        default=CACHE_TTL)
+    parser.add_argument('--cache-max-size', type=int, help='max size of the response cache in MB',
+                        default=CACHE_MAX_SIZE // 2 ** 20)
+    parser.add_argument('--offline', action='store_true', help='only use cached articles, never fetch', default=False)
+    parser.add_argument('--resolve-timeout', type=float, help='timeout (in seconds) of resolving a short link',
+                        default=RESOLVE_TIMEOUT)
+    parser.add_argument('--keep-http', action='store_true', default=False,
+                        help="don't rewrite http links to https (e.g. for scraping a local test server)")
+    parser.add_argument('--parser-backend', type=str, choices=list(PARSER_BACKENDS), default=DEFAULT_PARSER_BACKEND,
+                        help='HTML parsing backend for the article pages')
+    parser.add_argument('--resume', action='store_true', default=False,
+                        help='continue the output csv of a previous run, skipping links it already completed')
+    parser.add_argument('--metrics-report', type=str,
+                        help='path to write the run metrics to (Prometheus text format if it ends with .prom, else json)')
+    parser.add_argument('--profile', type=str, help='path to write a cProfile dump of the run to')
     args = parser.parse_args()
-    return args.data_dir, args.output_file, args.num_links, args.save_clickbaits, args.num_posts
+    return args
 
 
 if __name__ == '__main__':
-    data_dir, output_file, num_links, is_save_clickbaits, num_posts = parse_args()
-    if not os.path.exists(data_dir):
-        os.makedirs(data_dir)
-    if is_save_clickbaits:
-        save_clickbaits(data_dir, num_posts)
-    links = load_data(data_dir)[:num_links]
-    all_titles, all_links, all_bodies = get_articles(links)
-    save_to_csv(output_file, all_titles, all_links, all_bodies)
+    args = parse_args()
+    if not os.path.exists(args.data_dir):
+        os.makedirs(args.data_dir)
+    if args.save_clickbaits:
+        save_clickbaits(args.data_dir, args.num_posts, not args.full_refresh)
+    if args.capture_clickbaits:
+        capture_clickbaits(args.data_dir, args.num_posts, not args.full_refresh)
+    if args.parse_snapshots:
+        with timer('parse_snapshots'):
+            parse_snapshots(args.data_dir, args.parse_workers, args.reparse_snapshots)
+    session_pool = HostSessionPool(timeout=args.timeout, max_retries=args.max_retries,
+                                   min_request_interval=args.min_request_interval,
+                                   pool_size=max(HTTP_POOL_SIZE, args.num_workers))
+    parser_backend = args.parser_backend
+    force_https = not args.keep_http
+    state_dir = os.path.join(args.data_dir, SCRAPER_STATE_DIR_NAME)
+    short_link_resolver = ShortLinkResolver(session_pool, os.path.join(state_dir, SHORT_LINKS_STORE_NAME),
+                                            timeout=args.resolve_timeout)
+    if not args.no_cache:
+        cache_dir = args.cache_dir or os.path.join(state_dir, CACHE_DIR_NAME)
+        response_cache = ResponseCache(cache_dir, ttl=args.cache_ttl, max_size=args.cache_max_size * 2 ** 20,
+                                       offline=args.offline)
+    ledger = LinkLedger(f'{os.path.splitext(args.output_file)[0]}_ledger.jsonl', resume=args.resume)
+    with timer('load_data'):
+        links = [link for link in load_data(args.data_dir) if not ledger.is_completed(link)]
+    links = links[:args.num_links]
+    with profiled(args.profile), timer('scrape_articles'):
+        num_articles, errors = scrape_articles_to_csv(links, args.output_file, ledger, args.num_workers, args.resume)
+    ledger.close()
+    session_pool.close()
+    browser_pool.close()
+    if response_cache is not None:
+        response_cache.evict()
+    save_errors(args.output_file, errors)
+    write_report(args.metrics_report)
+    print(f'Scraped {num_articles} articles, {len(errors)} errors')
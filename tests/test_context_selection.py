@@ -0,0 +1,30 @@
+import pytest
+
+pytest.importorskip('torch')
+pytest.importorskip('transformers')
+pytest.importorskip('sentencepiece')
+
+from tiny_mt5 import make_tiny_mt5
+from context_selection import select_relevant_sentences
+
+TITLE = 'מה שקרה אחרי המשחק'
+
+
+@pytest.fixture(scope='module')
+def tokenizer(tmp_path_factory):
+    return make_tiny_mt5(str(tmp_path_factory.mktemp('tiny_mt5')))[1]
+
+
+def test_body_within_budget_is_kept_as_is(tokenizer):
+    body = 'הכוכב חשף את הסוד.\nמזג האוויר   גשם.'
+
+    assert select_relevant_sentences([TITLE], [body], tokenizer, 512) == [body]
+
+
+def test_long_body_is_reduced_to_relevant_sentences(tokenizer):
+    body = ' '.join(['מזג האוויר גשם סוף שבוע עם הצבא בירושלים.'] * 20 + ['המשחק נגמר אחרי מה שקרה.'])
+
+    reduced_body, = select_relevant_sentences([TITLE], [body], tokenizer, 40)
+
+    assert 'המשחק נגמר אחרי מה שקרה.' in reduced_body
+    assert len(tokenizer.tokenize(reduced_body)) < len(tokenizer.tokenize(body))
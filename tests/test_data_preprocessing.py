@@ -0,0 +1,46 @@
+import pytest
+
+pd = pytest.importorskip('pandas')
+pytest.importorskip('pyarrow')
+
+from consts import *
+from synthetic_data import make_synthetic_posts_df
+from data_preprocessing import preprocess_posts, apply_filters
+
+
+def test_parquet_output_with_empty_first_chunk(tmp_path):
+    posts_df = make_synthetic_posts_df(300, body_length=(10, 20))
+    posts_df.loc[:99, ARTICLE_TITLE_COLUMN_NAME] = 'Page not found'
+    posts_path = str(tmp_path / 'posts.parquet')
+    output_path = str(tmp_path / 'clean_posts.parquet')
+    posts_df.to_parquet(posts_path, index=False)
+
+    num_clean_rows, drop_counts = preprocess_posts(posts_path, output_path, chunk_size=100)
+
+    clean_posts_df = pd.read_parquet(output_path)
+    assert num_clean_rows > 0
+    assert len(clean_posts_df) == num_clean_rows
+    assert list(clean_posts_df.index) == list(range(num_clean_rows))
+    assert drop_counts['filter_invalid_article_titles'] > 0
+
+
+def test_parquet_output_with_only_empty_chunks(tmp_path):
+    posts_df = make_synthetic_posts_df(200, body_length=(10, 20))
+    posts_df[ARTICLE_TITLE_COLUMN_NAME] = 'Page not found'
+    posts_path = str(tmp_path / 'posts.parquet')
+    output_path = str(tmp_path / 'clean_posts.parquet')
+    posts_df.to_parquet(posts_path, index=False)
+
+    num_clean_rows, _ = preprocess_posts(posts_path, output_path, chunk_size=100)
+
+    assert num_clean_rows == 0
+    assert len(pd.read_parquet(output_path)) == 0
+
+
+def test_filters_keep_empty_frame_empty():
+    posts_df = make_synthetic_posts_df(10, body_length=(10, 20)).iloc[:0]
+
+    filtered_posts_df = apply_filters(posts_df)
+
+    assert len(filtered_posts_df) == 0
+    assert list(filtered_posts_df.columns) == list(posts_df.columns)
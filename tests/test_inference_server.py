@@ -0,0 +1,116 @@
+import json
+import time
+import threading
+import http.client
+import pytest
+
+pytest.importorskip('torch')
+pytest.importorskip('transformers')
+pytest.importorskip('sentencepiece')
+
+from tiny_mt5 import make_tiny_mt5
+from inference_server import create_server
+
+EXAMPLE = {'title': 'מה שקרה אחרי המשחק', 'body': 'הכוכב חשף את הסוד של המדינה'}
+
+
+@pytest.fixture(scope='module')
+def tiny_model(tmp_path_factory):
+    return make_tiny_mt5(str(tmp_path_factory.mktemp('tiny_mt5')))
+
+
+@pytest.fixture
+def start_server():
+    servers = []
+
+    def start(model, tokenizer, **batcher_kwargs):
+        server = create_server(model, tokenizer, port=0, **batcher_kwargs)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server.server_address[1]
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def request(port, method, path, body=None):
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    try:
+        connection.request(method, path, body=body, headers={'Content-Type': 'application/json'})
+        response = connection.getresponse()
+        return response.status, json.loads(response.read())
+    finally:
+        connection.close()
+
+
+def predict(port, example=EXAMPLE):
+    return request(port, 'POST', '/predict', json.dumps(example).encode('utf-8'))
+
+
+def predict_concurrently(port, num_requests):
+    responses = [None] * num_requests
+
+    def send(i):
+        responses[i] = predict(port)
+
+    threads = [threading.Thread(target=send, args=(i,)) for i in range(num_requests)]
+    for thread in threads:
+        thread.start()
+    return threads, responses
+
+
+def test_concurrent_requests_are_batched(tiny_model, start_server):
+    model, tokenizer = tiny_model
+    port = start_server(model, tokenizer, max_batch_size=4, max_batch_delay=2)
+
+    threads, responses = predict_concurrently(port, 4)
+    for thread in threads:
+        thread.join()
+
+    assert all(status == 200 and isinstance(content['prediction'], str) for status, content in responses)
+    _, metrics = request(port, 'GET', '/metrics')
+    assert metrics['completed'] == 4
+    assert metrics['batches'] == 1
+
+
+def test_full_queue_is_rejected(tiny_model, start_server, monkeypatch):
+    model, tokenizer = tiny_model
+    generation_started = threading.Event()
+    release_generation = threading.Event()
+    generate = model.generate
+
+    def blocking_generate(*args, **kwargs):
+        generation_started.set()
+        release_generation.wait()
+        return generate(*args, **kwargs)
+
+    monkeypatch.setattr(model, 'generate', blocking_generate)
+    port = start_server(model, tokenizer, max_batch_size=1, max_batch_delay=0, max_queue_size=1)
+
+    generating_threads, generating_responses = predict_concurrently(port, 1)
+    assert generation_started.wait(10)
+    queued_threads, queued_responses = predict_concurrently(port, 1)
+    while request(port, 'GET', '/metrics')[1]['queue_size'] < 1:
+        time.sleep(0.01)
+    status, content = predict(port)
+    release_generation.set()
+    for thread in generating_threads + queued_threads:
+        thread.join()
+
+    assert status == 503
+    assert 'error' in content
+    assert [status for status, _ in generating_responses + queued_responses] == [200, 200]
+    assert request(port, 'GET', '/metrics')[1]['rejected'] == 1
+
+
+@pytest.mark.parametrize('body', [b'not json', b'{"title": "no body"}', b'[1, 2]'])
+def test_bad_request_is_rejected(tiny_model, start_server, body):
+    model, tokenizer = tiny_model
+    port = start_server(model, tokenizer)
+
+    status, content = request(port, 'POST', '/predict', body)
+
+    assert status == 400
+    assert 'error' in content
@@ -0,0 +1,16 @@
+import pytest
+
+pytest.importorskip('bs4')
+
+from post_parsing import get_post_content
+
+
+def test_post_content_of_new_layout():
+    html_text = '<div><div data-ad-preview="message"> לא תאמינו מה קרה </div><a href="#">link</a></div>'
+    assert get_post_content(html_text, 'new') == 'לא תאמינו מה קרה'
+
+
+def test_post_without_text_has_empty_content():
+    html_text = '<div><a href="#"><img src="image.jpg"></a></div>'
+    assert get_post_content(html_text, 'new') == ''
+    assert get_post_content(html_text, 'old') == ''
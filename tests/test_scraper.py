@@ -0,0 +1,121 @@
+import time
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import pytest
+
+pytest.importorskip('pandas')
+pytest.importorskip('selenium')
+pytest.importorskip('news_scrapers')
+
+import scraper
+from response_cache import ResponseCache
+
+LOCAL_HOST = '127.0.0.1'
+DOMAIN_LIMIT = 2
+RESPONSE_DELAY = 0.1
+
+
+class ArticleHandler(BaseHTTPRequestHandler):
+    """
+    Serves /article/<n> as an article page titled "Article <n>", /error as a server error and any other path as a page
+    with no article, tracking
+    the max number of requests handled at the same time
+    """
+    lock = threading.Lock()
+    num_active = 0
+    max_active = 0
+
+    def do_GET(self):
+        with ArticleHandler.lock:
+            ArticleHandler.num_active += 1
+            ArticleHandler.max_active = max(ArticleHandler.max_active, ArticleHandler.num_active)
+        try:
+            time.sleep(RESPONSE_DELAY)
+            status = 200
+            if self.path.startswith('/article/'):
+                article_id = self.path.split('/')[-1]
+                body = f'<html><h1>Article {article_id}</h1><p>Body {article_id}</p></html>'
+            elif self.path.startswith('/error'):
+                status = 500
+                body = '<html><p>Server error</p></html>'
+            else:
+                body = '<html><p>Not found</p></html>'
+            content = body.encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+        finally:
+            with ArticleHandler.lock:
+                ArticleHandler.num_active -= 1
+
+    def log_message(self, *args):
+        pass
+
+
+def extract_from_local(page):
+    title = page.select_one('h1')
+    if title is None:
+        raise Exception("No article found")
+    return page.text(title), page.text(page.select_one('p'))
+
+
+@pytest.fixture
+def local_site(monkeypatch):
+    server = ThreadingHTTPServer((LOCAL_HOST, 0), ArticleHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    ArticleHandler.max_active = 0
+    monkeypatch.setattr(scraper, 'force_https', False)
+    monkeypatch.setattr(scraper, 'response_cache', None)
+    monkeypatch.setattr(scraper, 'session_pool', scraper.HostSessionPool(max_retries=0, min_request_interval=0))
+    monkeypatch.setattr(scraper, 'DOMAIN_CONCURRENCY_LIMITS', {LOCAL_HOST: DOMAIN_LIMIT})
+    monkeypatch.setitem(scraper.SITE_EXTRACTORS, LOCAL_HOST, extract_from_local)
+    yield f'http://{LOCAL_HOST}:{server.server_address[1]}'
+    scraper.session_pool.close()
+    server.shutdown()
+    server.server_close()
+
+
+def test_transform_url_keeps_http_when_not_forced(monkeypatch):
+    assert scraper.transform_url('http://walla.co.il/item/1?utm=x') == 'https://walla.co.il/item/1'
+    monkeypatch.setattr(scraper, 'force_https', False)
+    assert scraper.transform_url('http://walla.co.il/item/1?utm=x') == 'http://walla.co.il/item/1'
+
+
+def test_get_articles_concurrently(local_site):
+    links = [f'{local_site}/article/{i}' for i in range(8)]
+    links.insert(3, f'{local_site}/missing')
+    links.append('https://unsupported.example.com/article')
+
+    titles, scraped_links, bodies, errors = scraper.get_articles(links, num_workers=6)
+
+    assert titles == [f'Article {i}' for i in range(8)]
+    assert bodies == [f'Body {i}' for i in range(8)]
+    assert scraped_links == [link for link in links if '/article/' in link and LOCAL_HOST in link]
+    assert errors == [{'link': f'{local_site}/missing', 'error': 'No article found'}]
+    assert ArticleHandler.max_active == DOMAIN_LIMIT
+
+
+def test_fetch_serves_stale_cache_on_server_error(local_site, monkeypatch, tmp_path):
+    cache = ResponseCache(str(tmp_path / 'cache'), ttl=0)
+    monkeypatch.setattr(scraper, 'response_cache', cache)
+    cached_content = b'<html><h1>Cached</h1><p>Body</p></html>'
+    cache.put(f'{local_site}/error', cached_content, {})
+
+    assert scraper.fetch_html(f'{local_site}/error') == cached_content
+    assert b'Server error' in scraper.fetch_html(f'{local_site}/error/not_cached')
+    assert cache.stats['stale'] == 1
+
+
+def test_fetch_serves_stale_cache_on_connection_error(local_site, monkeypatch, tmp_path):
+    cache = ResponseCache(str(tmp_path / 'cache'), ttl=0)
+    monkeypatch.setattr(scraper, 'response_cache', cache)
+    cached_content = b'<html><h1>Cached</h1><p>Body</p></html>'
+    unreachable_url = 'http://127.0.0.1:1/article/0'
+    cache.put(unreachable_url, cached_content, {})
+
+    assert scraper.fetch_html(unreachable_url) == cached_content
+    with pytest.raises(scraper.requests.RequestException):
+        scraper.fetch_html('http://127.0.0.1:1/article/1')
@@ -0,0 +1,31 @@
+import pytest
+
+torch = pytest.importorskip('torch')
+pytest.importorskip('transformers')
+pytest.importorskip('sentencepiece')
+
+from tiny_mt5 import make_tiny_mt5
+from utils import load_model_and_tokenizer, generate_batch
+
+MODEL_INPUTS = ['question: מה שקרה אחרי המשחק context: הכוכב חשף את הסוד', 'question: מה context: גשם סוף שבוע']
+
+
+@pytest.fixture(scope='module')
+def tiny_model_dir(tmp_path_factory):
+    model_dir = str(tmp_path_factory.mktemp('tiny_mt5'))
+    make_tiny_mt5(model_dir)
+    return model_dir
+
+
+@pytest.mark.parametrize('dtype', [torch.float32, torch.bfloat16])
+def test_generate_with_quantized_model(tiny_model_dir, dtype):
+    model, tokenizer = load_model_and_tokenizer(None, tiny_model_dir, is_baseline=True, device='cpu', dtype=dtype,
+                                                quantize=True)
+
+    predictions, num_generated_tokens = generate_batch(model, tokenizer,
+                                                       [tokenizer(model_input)['input_ids']
+                                                        for model_input in MODEL_INPUTS])
+
+    assert len(predictions) == len(MODEL_INPUTS)
+    assert all(isinstance(prediction, str) for prediction in predictions)
+    assert num_generated_tokens >= 0
@@ -0,0 +1,71 @@
+import re
+import numpy as np
+from collections import Counter
+
+
+class RemovalRuleSet:
+    """
+    Removes a list of literal strings from text values, with the same result as calling str.replace(s, '') for each
+    string in order. All strings are compiled into one regex, so values with none of them are scanned only once
+    """
+
+    def __init__(self, strings):
+        """
+        :param strings: list of strings to remove (in order of removal)
+        """
+        self.strings = list(strings)
+        self.pattern = re.compile('|'.join(re.escape(s) for s in self.strings))
+        self.match_counts = Counter()
+
+    def apply(self, values):
+        """
+        removes the strings from all the values, counting the number of values each string was removed from
+        :param values: iterable of text values (non string values become NaN, like with the pandas str accessor)
+        :return: list of cleaned values
+        """
+        cleaned_values = []
+        for value in values:
+            if not isinstance(value, str):
+                cleaned_values.append(np.nan)
+                continue
+            if self.pattern.search(value) is not None:
+                for s in self.strings:
+                    if s in value:
+                        value = value.replace(s, '')
+                        self.match_counts[s] += 1
+            cleaned_values.append(value)
+        return cleaned_values
+
+
+class MatchRuleSet:
+    """
+    Finds text values matching any alternative of a regex (like pandas str.contains), scanning each value once with
+    the compiled regex and counting the values each alternative matched
+    """
+
+    def __init__(self, regex):
+        """
+        :param regex: regex made of '|' separated alternatives without groups (e.g. BAD_POST_TEXT_STRINGS_REG)
+        """
+        self.pattern = re.compile(regex)
+        self.rules = {alternative: re.compile(alternative) for alternative in regex.split('|')}
+        self.match_counts = Counter()
+
+    def find_matches(self, values):
+        """
+        :param values: iterable of text values
+        :return: boolean mask, True for values matching the regex (non string values are considered as matching, since
+        the filters drop them)
+        """
+        matches = []
+        for value in values:
+            if not isinstance(value, str):
+                matches.append(True)
+                continue
+            is_match = self.pattern.search(value) is not None
+            if is_match:
+                for alternative, rule in self.rules.items():
+                    if rule.search(value) is not None:
+                        self.match_counts[alternative] += 1
+            matches.append(is_match)
+        return np.array(matches, dtype=bool)
@@ -0,0 +1,112 @@
+import os
+import json
+import threading
+from urllib.parse import urljoin
+from concurrent.futures import ThreadPoolExecutor
+from tqdm import tqdm
+from consts import *
+
+
+class ShortLinkResolver:
+    """
+    Resolves shortened links (e.g. bit.ly) to the article url they redirect to, following multi-hop redirect
+    chains. Resolved links are kept in a persistent short url -> url store so known links are never resolved again
+    """
+
+    def __init__(self, session_pool, store_path=None, timeout=RESOLVE_TIMEOUT, max_hops=MAX_REDIRECT_HOPS):
+        """
+        :param session_pool: HostSessionPool used for sending the HEAD requests
+        :param store_path: path to the json store of resolved links (if None nothing is persisted)
+        :param timeout: timeout (in seconds) of a single HEAD request
+        :param max_hops: max number of redirects to follow
+        """
+        self.session_pool = session_pool
+        self.store_path = store_path
+        self.timeout = timeout
+        self.max_hops = max_hops
+        self.__resolved = {}
+        self.__failures = {}
+        self.__lock = threading.Lock()
+        if store_path is not None and os.path.exists(store_path):
+            with open(store_path, 'r') as f:
+                self.__resolved = json.load(f)
+
+    def __follow_redirects(self, url):
+        """
+        follows the redirect chain of the url until it reaches a supported news site or a non redirect response
+        :param url: shortened url
+        :return: the url at the end of the chain
+        """
+        visited = {url}
+        for _ in range(self.max_hops):
+            if any(domain in url for domain in DOMAIN_CONCURRENCY_LIMITS):
+                return url
+            r = self.session_pool.head(url, allow_redirects=False, timeout=self.timeout)
+            if not r.is_redirect:
+                return url
+            url = urljoin(url, r.headers['location'])
+            if url in visited:
+                raise Exception(f"Redirect loop when resolving {url}")
+            visited.add(url)
+        raise Exception(f"More than {self.max_hops} redirects when resolving {url}")
+
+    def resolve(self, url):
+        """
+        resolves a shortened url, looking it up in the store first
+        :param url: shortened url
+        :return: the url the shortened url redirects to
+        """
+        with self.__lock:
+            if url in self.__resolved:
+                return self.__resolved[url]
+            if url in self.__failures:
+                raise Exception(self.__failures[url])
+        try:
+            resolved_url = self.__follow_redirects(url)
+        except Exception as e:
+            with self.__lock:
+                self.__failures[url] = str(e)
+            raise
+        with self.__lock:
+            self.__resolved[url] = resolved_url
+        return resolved_url
+
+    def resolve_all(self, urls, num_workers=RESOLVE_NUM_WORKERS):
+        """
+        resolves all the unknown urls concurrently (failures are kept and raised again by resolve)
+        :param urls: list of shortened urls
+        :param num_workers: number of urls to resolve concurrently
+        :return: number of urls which failed to resolve
+        """
+        with self.__lock:
+            unknown_urls = [url for url in dict.fromkeys(urls)
+                            if url not in self.__resolved and url not in self.__failures]
+
+        def try_resolve(url):
+            try:
+                self.resolve(url)
+                return True
+            except Exception:
+                return False
+
+        if len(unknown_urls) == 0:
+            return 0
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            results = list(tqdm(executor.map(try_resolve, unknown_urls), total=len(unknown_urls),
+                                desc="Resolving short links"))
+        self.save()
+        return results.count(False)
+
+    def save(self):
+        """
+        saves the resolved links to the store
+        """
+        if self.store_path is None:
+            return
+        os.makedirs(os.path.dirname(self.store_path) or '.', exist_ok=True)
+        with self.__lock:
+            resolved = dict(self.__resolved)
+        tmp_path = f'{self.store_path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(resolved, f, ensure_ascii=False)
+        os.replace(tmp_path, self.store_path)
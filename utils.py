@@ -1,19 +1,62 @@
+import re
+import time
+import inspect
+import itertools
+import resource
 import torch
 import transformers
 from transformers import MT5ForConditionalGeneration, AutoModelForCausalLM, AutoTokenizer
+from transformers.modeling_utils import no_init_weights
 from consts import *
+from instrumentation import timer, increment
 
+WORD_PATTERN = re.compile(r'\S+')
 
-def merge_article_title_and_body_into_one_for_model_input(df):
+
+def trim_article_bodies_to_token_budget(titles, bodies, tokenizer, context_size):
+    """
+    trims article bodies (at word boundaries) so that the model input of each example fits in the context size,
+    leaving room for the question (the budget is estimated by tokenizing the question part separately, the tokenizer
+    still truncates inputs exceeding the context size)
+    :param titles: article titles
+    :param bodies: article bodies
+    :param tokenizer: sentencepiece based tokenizer (e.g. MT5Tokenizer)
+    :param context_size: max number of tokens of a model input
+    :return: list of trimmed bodies (non string bodies are kept as is)
+    """
+    question_lengths = [len(input_ids) for input_ids in
+                        tokenizer([MODEL_INPUT_FORMAT.format(title, '') for title in titles])[MODEL_INPUT_IDS]]
+    trimmed_bodies = []
+    for body, question_length in zip(bodies, question_lengths):
+        budget = context_size - question_length
+        if not isinstance(body, str) or budget <= 0:
+            trimmed_bodies.append(body if not isinstance(body, str) else '')
+            continue
+        # every word is at least one token, so the first budget tokens are within the first budget + 1 words
+        word_ends = [match.end() for match in itertools.islice(WORD_PATTERN.finditer(body), budget + 1)]
+        pieces = tokenizer.tokenize(body[:word_ends[-1]]) if len(word_ends) > 0 else []
+        if len(pieces) <= budget:
+            trimmed_bodies.append(body)
+            continue
+        # the first piece of every word starts with the sentencepiece word boundary mark
+        num_words = sum(piece.startswith(SENTENCEPIECE_WORD_MARK) for piece in pieces[:budget + 1]) - 1
+        trimmed_bodies.append(body[:word_ends[num_words - 1]] if num_words > 0 else '')
+    return trimmed_bodies
+
+
+def merge_article_title_and_body_into_one_for_model_input(df, tokenizer=None, context_size=None):
     """
     merge article title and body into one text using QA formatting to be used as model input (for each example)
     :param df: dataframe containing all examples
+    :param tokenizer: tokenizer for trimming the article bodies (needed only with context_size)
+    :param context_size: if given, article bodies are trimmed so the model input fits in this number of tokens
     :return: dataframe with new column representing the model input
     """
-    df[MODEL_INPUT_COLUMN_NAME] = None
-    for i in range(len(df)):
-        df[MODEL_INPUT_COLUMN_NAME][i] = MODEL_INPUT_FORMAT.format(df[ARTICLE_TITLE_COLUMN_NAME][i],
-                                                                                 df[BODY_COLUMN_NAME][i])
+    bodies = df[BODY_COLUMN_NAME]
+    if context_size is not None:
+        bodies = trim_article_bodies_to_token_budget(df[ARTICLE_TITLE_COLUMN_NAME], bodies, tokenizer, context_size)
+    df[MODEL_INPUT_COLUMN_NAME] = [MODEL_INPUT_FORMAT.format(title, body)
+                                   for title, body in zip(df[ARTICLE_TITLE_COLUMN_NAME], bodies)]
     return df
 
 
@@ -28,19 +71,90 @@ def remove_bad_tokens_from_model_output(model_output):
     return model_output
 
 
-def load_model_and_tokenizer(model_state_dict_path, pretrain_model_name, is_baseline=False):
+def generate_batch(model, tokenizer, batch_input_ids):
+    """
+    generates model predictions for a batch of tokenized model inputs
+    :param model: the model
+    :param tokenizer: the tokenizer
+    :param batch_input_ids: list of input ids lists (one per example)
+    :return: list of predictions (without bad tokens), and number of generated tokens
+    """
+    features = tokenizer.pad({MODEL_INPUT_IDS: batch_input_ids}, return_tensors='pt')
+    with timer('generate_batch'):
+        output = model.generate(input_ids=features[MODEL_INPUT_IDS].to(model.device),
+                                attention_mask=features[MODEL_ATTENTION_MASK].to(model.device),
+                                max_length=MAX_GENERATION_LENGTH)
+    num_generated_tokens = (output[:, 1:] != tokenizer.pad_token_id).sum().item()
+    increment('generated_examples', len(batch_input_ids))
+    increment('generated_tokens', num_generated_tokens)
+    predictions = [remove_bad_tokens_from_model_output(decoded_output)
+                   for decoded_output in tokenizer.batch_decode(output, skip_special_tokens=True)]
+    return predictions, num_generated_tokens
+
+
+def get_device():
+    """
+    :return: 'cuda' if a GPU is available, else 'cpu'
+    """
+    return 'cuda' if torch.cuda.is_available() else 'cpu'
+
+
+def load_state_dict(model_state_dict_path):
+    """
+    loads a state dict to CPU memory, memory-mapping the file when possible (safetensors files, or torch files with a
+    torch version supporting mmap)
+    :param model_state_dict_path: path to a .safetensors or a torch (.pt) state dict file
+    :return: state dict
+    """
+    if model_state_dict_path.endswith('.safetensors'):
+        from safetensors.torch import load_file
+        return load_file(model_state_dict_path, device='cpu')
+    if 'mmap' in inspect.signature(torch.load).parameters:
+        return torch.load(model_state_dict_path, map_location='cpu', mmap=True)
+    return torch.load(model_state_dict_path, map_location='cpu')
+
+
+@timer('load_model')
+def load_model_and_tokenizer(model_state_dict_path, pretrain_model_name, is_baseline=False, device=None,
+                             dtype=torch.float32, quantize=False):
     """
     loads MT5 model weight from given state dict if not baseline, else from pretrained based on model name
-    :param model_state_dict_path: path to model state dict
+    :param model_state_dict_path: path to model state dict (.pt or .safetensors)
     :param pretrain_model_name: name of pretrained model (e.g. google/mt5-base)
     :param is_baseline: if True loads from pretrained, if False from given state dict
+    :param device: device to load the model to (if None a GPU is used when available)
+    :param dtype: dtype of the model weights (e.g. torch.bfloat16)
+    :param quantize: if True applies dynamic int8 quantization to the linear layers (for CPU inference)
     :return: loaded model and matching tokenizer
     """
-    config = transformers.MT5Config.from_pretrained(pretrain_model_name)
-    model = MT5ForConditionalGeneration(config=config).to('cuda')
+    start_time = time.perf_counter()
+    device = device or get_device()
     tokenizer = transformers.MT5Tokenizer.from_pretrained(pretrain_model_name)
     if is_baseline:
-        model = transformers.MT5ForConditionalGeneration.from_pretrained(pretrain_model_name).to('cuda')
+        model = transformers.MT5ForConditionalGeneration.from_pretrained(pretrain_model_name, torch_dtype=dtype)
     else:
-        model.load_state_dict(torch.load(model_state_dict_path), strict=False)
+        config = transformers.MT5Config.from_pretrained(pretrain_model_name)
+        # the weights are overwritten by the state dict, so skip their random initialization
+        with no_init_weights():
+            model = MT5ForConditionalGeneration(config=config)
+        missing_keys, unexpected_keys = model.load_state_dict(load_state_dict(model_state_dict_path), strict=False)
+        # tied weights (e.g. the embeddings shared by the encoder and decoder) are saved only once in safetensors files
+        loaded_params = {id(param) for name, param in model.named_parameters(remove_duplicate=False)
+                         if name not in missing_keys}
+        missing_keys = [name for name, param in model.named_parameters(remove_duplicate=False)
+                        if name in missing_keys and id(param) not in loaded_params]
+        if len(missing_keys) > 0:
+            raise RuntimeError(f"Missing weights in {model_state_dict_path}: {missing_keys}")
+        if len(unexpected_keys) > 0:
+            print(f"Ignoring unexpected weights in {model_state_dict_path}: {unexpected_keys}")
+        model = model.to(dtype)
+    model.eval()
+    if quantize:
+        # the quantized linear layers only take float32 activations
+        model = model.to(torch.float32)
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        device = 'cpu'
+    model = model.to(device)
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"Loaded model to {device} in {time.perf_counter() - start_time:.1f}s, peak RSS {peak_rss_mb:.0f} MB")
     return model, tokenizer
\ No newline at end of file